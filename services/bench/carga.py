@@ -0,0 +1,328 @@
+"""
+Benchmark de punta a punta de los cuatro servicios.
+
+Levanta productos, inventario, pagos y pedidos como procesos aparte (DBs temporales),
+carga N productos con stock y dispara una mezcla configurable de operaciones con
+C clientes concurrentes:
+- normal:   pedido de 1-3 productos al azar
+- caliente: pedido que incluye siempre el SKU 1 (contención sobre una fila de stock)
+- grande:   carrito de --items-grande líneas
+- detalle:  GET /pedidos/<id> de un pedido ya creado
+- catalogo: GET /productos (primera página)
+Una fracción --rechazo de los pedidos paga con "fail": true (pago rechazado -> compensación).
+
+Imprime (o guarda con --salida) un JSON con throughput, p50/p95/p99 por endpoint y
+escenario, y tasas de error y compensación. Con --comparar ANTERIOR.json muestra la
+variación contra otra corrida y sale con código 1 si algún p95 empeoró más que --umbral.
+Con --monolito los cuatro corren en un solo proceso (monolito.py) en vez de cuatro.
+
+    python carga.py --productos 200 --operaciones 3000 --concurrencia 16 \\
+        --mix normal=60,caliente=20,grande=10,detalle=10 --rechazo 0.1 --salida base.json
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SERVICES = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "penguin-secret"
+HEADERS = {"Authorization": f"Bearer {TOKEN}"}
+ORDEN = ("productos", "inventario", "pagos", "pedidos")
+ESCENARIOS = ("normal", "caliente", "grande", "detalle", "catalogo")
+ENDPOINT = {"normal": "POST /pedidos", "caliente": "POST /pedidos", "grande": "POST /pedidos",
+            "detalle": "GET /pedidos/<id>", "catalogo": "GET /productos"}
+
+# --servidor dev: app.py con el servidor de desarrollo (sin reloader ni debugger, logs de werkzeug apagados)
+ARRANQUE = ("import logging, app; logging.getLogger('werkzeug').setLevel(logging.WARNING); "
+            "app.init_db(); app.app.run(host='127.0.0.1', port=app.PORT, threaded=True)")
+
+ARRANQUE_MONOLITO = ("import logging, monolito; from werkzeug.serving import run_simple; "
+                     "logging.getLogger('werkzeug').setLevel(logging.WARNING); monolito.init_db(); "
+                     "run_simple('127.0.0.1', monolito.PORT, monolito.create_app(), threaded=True)")
+
+def comando(svc: str, servidor: str) -> list:
+    if servidor == "dev":
+        return [sys.executable, "-c", ARRANQUE_MONOLITO if svc == "monolito" else ARRANQUE]
+    return [sys.executable, os.path.join(SERVICES, "serve.py"), svc, "--servidor", servidor]
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def levantar(tmp: str, extra_env: dict, servidor: str = "dev") -> tuple[dict, list]:
+    """Arranca los cuatro servicios; devuelve ({svc: base_url}, procesos)."""
+    puertos = {svc: puerto_libre() for svc in ORDEN}
+    urls = {svc: f"http://127.0.0.1:{p}" for svc, p in puertos.items()}
+    procs = []
+    for svc in ORDEN:
+        env = {**os.environ, "TRACING": "0", **extra_env,
+               "PORT": str(puertos[svc]), "HOST": "127.0.0.1", "SERVICE_TOKEN": TOKEN,
+               "DB_PATH": os.path.join(tmp, f"{svc}.db"), "TRACE_FILE": os.path.join(tmp, f"{svc}.spans.jsonl"),
+               "PRODUCTS_URL": urls["productos"], "INVENTORY_URL": urls["inventario"],
+               "PAYMENTS_URL": urls["pagos"]}
+        log = open(os.path.join(tmp, f"{svc}.log"), "w")
+        procs.append(subprocess.Popen(comando(svc, servidor), cwd=os.path.join(SERVICES, svc),
+                                      env=env, stdout=log, stderr=subprocess.STDOUT))
+    for svc in ORDEN:
+        esperar_health(urls[svc], svc, tmp)
+    return urls, procs
+
+def levantar_monolito(tmp: str, extra_env: dict, servidor: str = "dev") -> tuple[dict, list]:
+    """Los cuatro servicios en un proceso: todas las URLs apuntan al mismo puerto."""
+    base = f"http://127.0.0.1:{puerto_libre()}"
+    env = {**os.environ, "TRACING": "0", **extra_env,
+           "MONOLITO_PORT": base.rsplit(":", 1)[1], "HOST": "127.0.0.1", "SERVICE_TOKEN": TOKEN,
+           "TRACE_FILE": os.path.join(tmp, "monolito.spans.jsonl"),
+           **{f"{svc.upper()}_DB_PATH": os.path.join(tmp, f"{svc}.db") for svc in ORDEN}}
+    log = open(os.path.join(tmp, "monolito.log"), "w")
+    proc = subprocess.Popen(comando("monolito", servidor), cwd=SERVICES, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    esperar_health(base, "monolito", tmp)
+    return {svc: base for svc in ORDEN}, [proc]
+
+def esperar_health(base: str, svc: str, tmp: str, timeout: float = 20.0):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            if requests.get(f"{base}/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise SystemExit(f"{svc} no respondió /health en {timeout}s (ver {tmp}/{svc}.log)")
+
+def sembrar(urls: dict, productos: int, stock: int, stock_caliente: int) -> list[int]:
+    """Catálogo y stock por las importaciones masivas (DBs nuevas: ids 1..N)."""
+    s = requests.Session()
+    s.headers.update(HEADERS)
+    ids = list(range(1, productos + 1))
+    for svc, ruta, filas in (
+        ("productos", "/productos/importar",
+         ({"id": pid, "nombre": f"bench-{pid:05d}", "precio": 1000 + pid} for pid in ids)),
+        ("inventario", "/stock/importar",
+         ({"producto_id": pid, "cantidad": stock_caliente if pid == 1 else stock} for pid in ids)),
+    ):
+        body = "".join(json.dumps(f) + "\n" for f in filas).encode()
+        r = s.post(f"{urls[svc]}{ruta}", data=body, headers={"Content-Type": "application/x-ndjson"})
+        r.raise_for_status()
+        if r.json()["con_error"]:
+            raise SystemExit(f"siembra de {svc} con errores: {r.json()['errores'][:3]}")
+    return ids
+
+def parse_mix(texto: str) -> dict:
+    mix = {}
+    for parte in texto.split(","):
+        nombre, _, peso = parte.partition("=")
+        nombre = nombre.strip()
+        if nombre not in ESCENARIOS:
+            raise SystemExit(f"Escenario desconocido: {nombre!r} (válidos: {', '.join(ESCENARIOS)})")
+        mix[nombre] = float(peso or 1)
+    return mix
+
+def percentil(ordenados, p):
+    """Rango más cercano sobre una lista ya ordenada."""
+    if not ordenados:
+        return None
+    k = max(0, min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1))
+    return ordenados[k]
+
+def resumen(muestras, segundos) -> dict:
+    lat = sorted(m["ms"] for m in muestras)
+    codigos = defaultdict(int)
+    for m in muestras:
+        codigos[str(m["status"])] += 1
+    errores = sum(1 for m in muestras if m["status"] == "exc" or m["status"] >= 500)
+    return {
+        "n": len(muestras),
+        "rps": round(len(muestras) / segundos, 1) if segundos else None,
+        "p50_ms": round(percentil(lat, 50), 2) if lat else None,
+        "p95_ms": round(percentil(lat, 95), 2) if lat else None,
+        "p99_ms": round(percentil(lat, 99), 2) if lat else None,
+        "max_ms": round(lat[-1], 2) if lat else None,
+        "tasa_error": round(errores / len(muestras), 4) if muestras else 0.0,
+        "status": dict(sorted(codigos.items())),
+    }
+
+class Carga:
+    def __init__(self, urls, ids, args):
+        self.urls, self.ids, self.args = urls, ids, args
+        self.mix = parse_mix(args.mix)
+        self.rng = random.Random(args.semilla)
+        self._lock = threading.Lock()
+        self.pedidos_creados = []
+        self._local = threading.local()
+
+    def sesion(self) -> requests.Session:
+        s = getattr(self._local, "s", None)
+        if s is None:
+            s = self._local.s = requests.Session()
+            s.headers.update(HEADERS)
+        return s
+
+    def plan(self, n):
+        """Secuencia de escenarios y sus parámetros, decidida de antemano (reproducible con --semilla)."""
+        nombres, pesos = zip(*self.mix.items())
+        ops = []
+        for _ in range(n):
+            esc = self.rng.choices(nombres, pesos)[0]
+            ops.append((esc, self.rng.random(), self.rng.getrandbits(32)))
+        return ops
+
+    def carrito(self, esc, semilla):
+        rng = random.Random(semilla)
+        if esc == "grande":
+            elegidos = rng.sample(self.ids, min(self.args.items_grande, len(self.ids)))
+        else:
+            elegidos = rng.sample(self.ids, min(rng.randint(1, 3), len(self.ids)))
+            if esc == "caliente" and 1 not in elegidos:
+                elegidos[0] = 1
+        return [{"producto_id": pid, "cantidad": 1} for pid in elegidos]
+
+    def ejecutar(self, op):
+        esc, azar, semilla = op
+        s = self.sesion()
+        t0 = time.perf_counter()
+        estado = None
+        try:
+            if esc == "detalle":
+                with self._lock:
+                    pid = random.Random(semilla).choice(self.pedidos_creados) if self.pedidos_creados else None
+                if pid is None:
+                    esc = "catalogo"
+                    t0 = time.perf_counter()
+                    r = s.get(f"{self.urls['productos']}/productos", params={"limit": 50})
+                else:
+                    r = s.get(f"{self.urls['pedidos']}/pedidos/{pid}")
+            elif esc == "catalogo":
+                r = s.get(f"{self.urls['productos']}/productos", params={"limit": 50})
+            else:
+                pago = {"medio": "tarjeta", "moneda": "PYG"}
+                if azar < self.args.rechazo:
+                    pago["fail"] = True
+                r = s.post(f"{self.urls['pedidos']}/pedidos", json={"items": self.carrito(esc, semilla), "pago": pago})
+                if r.status_code in (201, 202):
+                    body = r.json()
+                    estado = body.get("estado")
+                    with self._lock:
+                        self.pedidos_creados.append(body["pedido_id"])
+            status = r.status_code
+        except requests.RequestException:
+            status = "exc"
+        return {"escenario": esc, "endpoint": ENDPOINT[esc], "status": status, "estado": estado,
+                "ms": (time.perf_counter() - t0) * 1000}
+
+    def correr(self):
+        if self.args.calentamiento:
+            with ThreadPoolExecutor(self.args.concurrencia) as ex:
+                list(ex.map(self.ejecutar, self.plan(self.args.calentamiento)))
+        ops = self.plan(self.args.operaciones)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(self.args.concurrencia) as ex:
+            muestras = list(ex.map(self.ejecutar, ops))
+        return muestras, time.perf_counter() - t0
+
+def reporte(muestras, segundos, args) -> dict:
+    por_endpoint, por_escenario = defaultdict(list), defaultdict(list)
+    for m in muestras:
+        por_endpoint[m["endpoint"]].append(m)
+        por_escenario[m["escenario"]].append(m)
+    pedidos = por_endpoint.get("POST /pedidos", [])
+    n = len(pedidos) or 1
+    return {
+        "fecha": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar", "umbral")},
+        "segundos": round(segundos, 3),
+        "total": resumen(muestras, segundos),
+        "endpoints": {k: resumen(v, segundos) for k, v in sorted(por_endpoint.items())},
+        "escenarios": {k: resumen(v, segundos) for k, v in sorted(por_escenario.items())},
+        "pedidos": {
+            "confirmados": sum(1 for m in pedidos if m["estado"] == "confirmado"),
+            "compensados": sum(1 for m in pedidos if m["estado"] == "cancelado"),
+            "pendientes": sum(1 for m in pedidos if m["estado"] == "pendiente"),
+            "sin_stock": sum(1 for m in pedidos if m["status"] == 409),
+            "tasa_compensacion": round(sum(1 for m in pedidos if m["estado"] == "cancelado") / n, 4),
+            "tasa_error": round(sum(1 for m in pedidos if m["status"] == "exc" or m["status"] >= 500) / n, 4),
+        },
+    }
+
+def comparar(actual: dict, anterior: dict, umbral: float) -> bool:
+    """Imprime la variación por endpoint (a stderr); False si algún p95 empeoró más que umbral."""
+    ok = True
+    for ep, now in actual["endpoints"].items():
+        before = anterior.get("endpoints", {}).get(ep)
+        if not before:
+            continue
+        partes = []
+        for k in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            a, b = now.get(k), before.get(k)
+            if a is None or not b:
+                continue
+            delta = (a - b) / b
+            partes.append(f"{k} {b} -> {a} ({delta:+.1%})")
+            if k == "p95_ms" and delta > umbral:
+                ok = False
+        print(f"{ep}: " + ", ".join(partes), file=sys.stderr)
+    return ok
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--productos", type=int, default=200)
+    ap.add_argument("--stock", type=int, default=1_000_000, help="stock inicial por producto")
+    ap.add_argument("--stock-caliente", type=int, default=1_000_000, help="stock del SKU 1")
+    ap.add_argument("--operaciones", type=int, default=2000)
+    ap.add_argument("--calentamiento", type=int, default=100, help="operaciones previas que no se miden")
+    ap.add_argument("--concurrencia", type=int, default=16)
+    ap.add_argument("--mix", default="normal=60,caliente=20,grande=10,detalle=10")
+    ap.add_argument("--items-grande", type=int, default=25)
+    ap.add_argument("--rechazo", type=float, default=0.1, help="fracción de pedidos con pago rechazado")
+    ap.add_argument("--semilla", type=int, default=42)
+    ap.add_argument("--servidor", choices=("dev", "gunicorn", "waitress"), default="dev",
+                    help="cómo se sirven los servicios (dev = app.run; el resto, serve.py)")
+    ap.add_argument("--monolito", action="store_true", help="los cuatro servicios en un solo proceso")
+    ap.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                    help="variable extra para los servicios (repetible), p.ej. --env PAGO_ASYNC=1")
+    ap.add_argument("--salida", help="archivo JSON donde guardar el reporte")
+    ap.add_argument("--comparar", help="reporte anterior contra el cual comparar")
+    ap.add_argument("--umbral", type=float, default=0.2, help="empeoramiento de p95 tolerado (0.2 = 20%%)")
+    args = ap.parse_args()
+
+    extra_env = dict(e.split("=", 1) for e in args.env)
+    tmp = tempfile.mkdtemp(prefix="bench_carga_")
+    urls, procs = (levantar_monolito if args.monolito else levantar)(tmp, extra_env, args.servidor)
+    try:
+        ids = sembrar(urls, args.productos, args.stock, args.stock_caliente)
+        muestras, segundos = Carga(urls, ids, args).correr()
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+
+    rep = reporte(muestras, segundos, args)
+    texto = json.dumps(rep, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    print(texto)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            if not comparar(rep, json.load(f), args.umbral):
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
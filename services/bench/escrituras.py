@@ -0,0 +1,120 @@
+"""
+Throughput de escritura de pagos y pedidos, directo contra group commit.
+
+Carga el servicio en este mismo proceso (DB temporal) y dispara N altas en paralelo con
+distintos números de workers, llamando directo al camino de escritura (sin HTTP, que en una
+máquina chica tapa la diferencia):
+- pagos:   registrar_pago() (con --con-clave, además reserva y guarda su Idempotency-Key)
+- pedidos: guardar_pedido() (la escritura de la saga: pedido, items y resúmenes de ventas)
+Modo "agrupado" = PAGOS_AGRUPADOS=1 / PEDIDOS_AGRUPADOS=1. Verifica que cada alta devolvió un id
+distinto y que la tabla tiene exactamente N filas nuevas; sale con código 1 si no.
+--synchronous FULL hace un fsync por COMMIT, donde más se nota agrupar.
+
+    python escrituras.py --servicio pagos --altas 3000 --workers 1,8,32 --modos directo,agrupado
+    python escrituras.py --servicio pedidos --altas 3000 --workers 1,8,32 --synchronous FULL
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+SERVICES = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "penguin-secret"
+BANDERA = {"pagos": "PAGOS_AGRUPADOS", "pedidos": "PEDIDOS_AGRUPADOS"}
+TABLA = {"pagos": "pagos", "pedidos": "pedidos"}
+
+def cargar(servicio: str, db_path: str, agrupado: bool):
+    os.environ["DB_PATH"] = db_path
+    os.environ[BANDERA[servicio]] = "1" if agrupado else "0"
+    os.environ["SERVICE_TOKEN"] = TOKEN
+    os.environ["TRACING"] = "0"        # sin spans.jsonl en la carpeta del bench
+    carpeta = os.path.join(SERVICES, servicio)
+    sys.path.insert(0, carpeta)
+    spec = importlib.util.spec_from_file_location(f"{servicio}_app", os.path.join(carpeta, "app.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    sys.path.remove(carpeta)
+    mod.init_db()
+    return mod
+
+def alta_pagos(mod, con_clave: bool):
+    def una(n):
+        data = {"monto": 1000 + n, "referencia": f"b{n}"}
+        try:
+            if con_clave:
+                body, _, _ = mod.idempotente.ejecutar(f"bench-{uuid.uuid4().hex}", data,
+                                                   lambda: (mod.registrar_pago(data), 200))
+            else:
+                body = mod.registrar_pago(data)
+            return body["pago_id"]
+        finally:
+            mod.db.release()
+    return una
+
+def alta_pedidos(mod, con_clave: bool):
+    detalle = [{"producto_id": 1 + k, "cantidad": 1, "precio_unit": 10.0} for k in range(3)]
+
+    def una(n):
+        try:
+            return mod.guardar_pedido(30.0, "confirmado", detalle)
+        finally:
+            mod.db.release()
+    return una
+
+def correr(mod, servicio: str, db_path: str, altas: int, workers: int, modo: str, con_clave: bool) -> dict:
+    antes = contar(db_path, TABLA[servicio])
+    una = (alta_pagos if servicio == "pagos" else alta_pedidos)(mod, con_clave)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        ids = list(ex.map(una, range(altas)))
+    dur = time.perf_counter() - t0
+    nuevas = contar(db_path, TABLA[servicio]) - antes
+    return {
+        "servicio": servicio,
+        "modo": modo,
+        "workers": workers,
+        "altas": altas,
+        "segundos": round(dur, 3),
+        "altas_por_seg": round(altas / dur, 1),
+        "consistente": len(set(ids)) == altas and nuevas == altas,
+    }
+
+def contar(db_path: str, tabla: str) -> int:
+    con = sqlite3.connect(db_path)
+    try:
+        return con.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+    finally:
+        con.close()
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--servicio", choices=("pagos", "pedidos"), default="pagos")
+    ap.add_argument("--altas", type=int, default=3000)
+    ap.add_argument("--workers", default="1,8,32")
+    ap.add_argument("--modos", default="directo,agrupado", help="directo y/o agrupado (PAGOS_/PEDIDOS_AGRUPADOS=1)")
+    ap.add_argument("--con-clave", action="store_true", help="pagos: cada alta con Idempotency-Key")
+    ap.add_argument("--synchronous", help="SQLITE_SYNCHRONOUS para la corrida (p.ej. FULL)")
+    args = ap.parse_args()
+
+    if args.synchronous:
+        os.environ["SQLITE_SYNCHRONOUS"] = args.synchronous
+    logging.disable(logging.INFO)
+    resultados = []
+    for modo in args.modos.split(","):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench_escr_"), f"{args.servicio}.db")
+        mod = cargar(args.servicio, db_path, agrupado=(modo == "agrupado"))
+        for w in args.workers.split(","):
+            resultados.append(correr(mod, args.servicio, db_path, args.altas, int(w), modo, args.con_clave))
+    print(json.dumps(resultados, indent=2))
+    if not all(r["consistente"] for r in resultados):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
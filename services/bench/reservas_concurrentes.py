@@ -0,0 +1,111 @@
+"""
+Prueba de concurrencia de /reservar sobre un SKU caliente.
+
+Levanta inventario en este mismo proceso (DB temporal), carga stock y dispara
+miles de reservas en paralelo con distintos números de workers. Verifica que:
+- el stock nunca queda negativo,
+- stock final == stock inicial - reservas aceptadas,
+- las reservas 'activa' en la tabla coinciden con las aceptadas.
+Imprime el throughput por cantidad de workers en JSON. Sale con código 1 si
+algún invariante se rompe. Con --modos directo,agrupado corre también con
+RESERVAS_AGRUPADAS=1 (group commit) para comparar.
+
+    python reservas_concurrentes.py --reservas 2000 --stock 1500 --workers 1,4,16,32 --modos directo,agrupado
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+SERVICES = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "penguin-secret"
+HEADERS = {"Authorization": f"Bearer {TOKEN}"}
+
+def levantar_inventario(db_path: str, port: int, agrupadas: bool = False):
+    os.environ["DB_PATH"] = db_path
+    os.environ["RESERVAS_AGRUPADAS"] = "1" if agrupadas else "0"
+    os.environ["SERVICE_TOKEN"] = TOKEN
+    os.environ["TRACING"] = "0"        # sin spans.jsonl en la carpeta del bench
+    sys.path.insert(0, os.path.join(SERVICES, "inventario"))
+    spec = importlib.util.spec_from_file_location("inventario_app", os.path.join(SERVICES, "inventario", "app.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    mod.init_db()
+    srv = make_server("127.0.0.1", port, mod.app, threaded=True)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+def correr(base: str, db_path: str, producto_id: int, stock: int, reservas: int, workers: int, modo: str) -> dict:
+    requests.post(f"{base}/stock", headers=HEADERS, json={"producto_id": producto_id, "cantidad": stock}).raise_for_status()
+    local = threading.local()
+
+    def una(_):
+        s = getattr(local, "s", None)
+        if s is None:
+            s = local.s = requests.Session()
+        r = s.post(f"{base}/reservar", headers=HEADERS, json={"producto_id": producto_id, "cantidad": 1})
+        return r.status_code
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        codes = list(ex.map(una, range(reservas)))
+    dur = time.perf_counter() - t0
+
+    ok = codes.count(200)
+    sin_stock = codes.count(409)
+    final = requests.get(f"{base}/stock/{producto_id}", headers=HEADERS).json()["cantidad"]
+    con = sqlite3.connect(db_path)
+    activas = con.execute("SELECT COUNT(*) FROM reservas WHERE producto_id=? AND estado='activa'",
+                          (producto_id,)).fetchone()[0]
+    con.close()
+    return {
+        "modo": modo,
+        "workers": workers,
+        "reservas": reservas,
+        "aceptadas": ok,
+        "sin_stock": sin_stock,
+        "otros_errores": reservas - ok - sin_stock,
+        "stock_final": final,
+        "segundos": round(dur, 3),
+        "reservas_por_seg": round(reservas / dur, 1),
+        "consistente": final >= 0 and final == stock - ok and activas == ok and ok <= stock,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--reservas", type=int, default=2000)
+    ap.add_argument("--stock", type=int, default=1500)
+    ap.add_argument("--workers", default="1,4,16,32")
+    ap.add_argument("--modos", default="directo", help="directo y/o agrupado (RESERVAS_AGRUPADAS=1)")
+    ap.add_argument("--port", type=int, default=15102)
+    args = ap.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    resultados = []
+    for i, modo in enumerate(args.modos.split(",")):
+        tmp = tempfile.mkdtemp(prefix="bench_inv_")
+        db_path = os.path.join(tmp, "inventario.db")
+        port = args.port + i
+        srv = levantar_inventario(db_path, port, agrupadas=(modo == "agrupado"))
+        base = f"http://127.0.0.1:{port}"
+        try:
+            resultados += [correr(base, db_path, n + 1, args.stock, args.reservas, int(w), modo)
+                           for n, w in enumerate(args.workers.split(","))]
+        finally:
+            srv.shutdown()
+    print(json.dumps(resultados, indent=2))
+    if not all(r["consistente"] for r in resultados):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
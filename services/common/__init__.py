@@ -0,0 +1 @@
+"""Piezas compartidas por los cuatro servicios (se importan agregando services/ al sys.path)."""
@@ -0,0 +1,108 @@
+import os
+import queue
+import sqlite3
+import threading
+import logging
+
+from .metrics import SQL_METRICS, TimedConnection
+
+log = logging.getLogger(__name__)
+
+# Ajustes SQLite (iguales para todos los servicios, sobreescribibles por env)
+JOURNAL_MODE    = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SYNCHRONOUS     = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+CACHE_SIZE      = int(os.getenv("SQLITE_CACHE_SIZE", "-16000"))     # negativo = KiB
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+POOL_SIZE       = int(os.getenv("SQLITE_POOL_SIZE", "16"))          # conexiones ociosas que se guardan
+
+class Database:
+    """
+    Conexiones SQLite persistentes con WAL.
+    - Cada hilo usa su propia conexión mientras atiende un request.
+    - Al terminar el request (teardown) la conexión vuelve a un pool de ociosas,
+      así los servidores que crean un hilo por request tampoco reconectan siempre.
+    - Conexiones cerradas o heredadas de otro proceso (fork) se descartan y se abre una nueva.
+    """
+
+    def __init__(self, path: str, pool_size: int = POOL_SIZE):
+        self.path = path
+        self._local = threading.local()
+        self._idle = queue.LifoQueue(maxsize=max(0, pool_size))
+        self._pid = os.getpid()
+
+    def _open(self) -> sqlite3.Connection:
+        kwargs = {}
+        if SQL_METRICS:
+            kwargs["factory"] = TimedConnection
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False, **kwargs)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size={CACHE_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    @staticmethod
+    def _usable(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.total_changes   # ProgrammingError si la conexión está cerrada
+            return True
+        except sqlite3.ProgrammingError:
+            return False
+
+    def _check_fork(self):
+        # Tras un fork las conexiones del padre no se pueden usar
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._local = threading.local()
+            self._idle = queue.LifoQueue(maxsize=self._idle.maxsize)
+
+    def connection(self) -> sqlite3.Connection:
+        self._check_fork()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._usable(conn):
+            return conn
+        conn = None
+        while conn is None:
+            try:
+                cand = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+                break
+            if self._usable(cand):
+                conn = cand
+        self._local.conn = conn
+        return conn
+
+    def release(self, exc=None):
+        """Devuelve la conexión del hilo actual al pool (usar como teardown)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if not self._usable(conn):
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def init_app(self, app):
+        app.teardown_appcontext(self.release)
+
+    def close_all(self):
+        self.release()
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+def add_column_if_missing(con, table: str, column: str, ddl: str):
+    """Migración mínima para DBs ya creadas: ALTER TABLE ... ADD COLUMN si falta."""
+    cols = {r[1] for r in con.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
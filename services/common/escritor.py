@@ -0,0 +1,123 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+log = logging.getLogger(__name__)
+
+VENTANA_MS = float(os.getenv("ESCRITOR_VENTANA_MS", "0"))   # espera extra para juntar operaciones (0 = lo ya encolado)
+MAX_LOTE   = int(os.getenv("ESCRITOR_MAX_LOTE", "64"))      # operaciones por transacción
+TIMEOUT    = float(os.getenv("ESCRITOR_TIMEOUT", "10"))     # s que un request espera su resultado
+
+class Deshacer(Exception):
+    """Una operación la lanza para descartar sus cambios y devolver igual `resultado` (p.ej. sin stock)."""
+
+    def __init__(self, resultado):
+        super().__init__(resultado)
+        self.resultado = resultado
+
+class EscrituraIncierta(TimeoutError):
+    """Venció el timeout esperando el lote: la operación sigue encolada y todavía puede confirmarse."""
+
+class EscritorAgrupado:
+    """
+    Group commit sobre SQLite: un hilo escritor por proceso aplica en una sola transacción
+    las operaciones que encolan los hilos de request.
+    - SQLite admite un escritor a la vez; en vez de N hilos peleando el lock (y durmiendo
+      en el busy handler), uno solo lo toma una vez por lote y hace un único COMMIT.
+    - Tras la primera operación espera hasta `ventana` s o `max_lote` operaciones.
+    - Cada operación fn(cursor, *args) corre en su SAVEPOINT: si lanza (o lanza Deshacer),
+      sólo se deshacen sus cambios y el resto del lote sigue.
+    - ejecutar() devuelve el resultado recién después del COMMIT; si el COMMIT falla,
+      todas las operaciones del lote reciben la excepción. Si vence `timeout` antes,
+      lanza EscrituraIncierta: no se sabe si la operación quedó escrita.
+    """
+
+    def __init__(self, db, ventana=VENTANA_MS / 1000, max_lote=MAX_LOTE, nombre="escritor"):
+        self.db = db
+        self.ventana = ventana
+        self.max_lote = max(1, max_lote)
+        self.nombre = nombre
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def ejecutar(self, fn, *args, timeout=TIMEOUT):
+        self._ensure_worker()
+        fut = Future()
+        self._cola.put((fn, args, fut))
+        try:
+            return fut.result(timeout)
+        except FutureTimeout:
+            raise EscrituraIncierta(f"{self.nombre}: sin resultado tras {timeout}s") from None
+
+    # --- internos ---
+
+    def _ensure_worker(self):
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Tras un fork el hilo del padre no existe en el hijo
+                self._pid = os.getpid()
+                self._cola = queue.Queue()
+                self._hilo = None
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._loop, name=self.nombre, daemon=True)
+                self._hilo.start()
+
+    def _juntar(self):
+        lote = [self._cola.get()]
+        limite = time.monotonic() + self.ventana
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self._cola.get(timeout=restante) if restante > 0 else self._cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _aplicar(self, lote):
+        con = self.db.connection()
+        resultados = []
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            c = con.cursor()
+            for fn, args, _ in lote:
+                c.execute("SAVEPOINT op")
+                try:
+                    resultados.append((True, fn(c, *args)))
+                except Deshacer as d:
+                    c.execute("ROLLBACK TO op")
+                    resultados.append((True, d.resultado))
+                except Exception as e:
+                    c.execute("ROLLBACK TO op")
+                    resultados.append((False, e))
+                c.execute("RELEASE op")
+            con.commit()
+        except Exception as e:
+            if con.in_transaction:
+                con.rollback()
+            log.exception("[%s] falló el lote de %s operaciones", self.nombre, len(lote))
+            for _, _, fut in lote:
+                fut.set_exception(e)
+            return
+        for (_, _, fut), (ok, valor) in zip(lote, resultados):
+            if ok:
+                fut.set_result(valor)
+            else:
+                fut.set_exception(valor)
+
+    def _loop(self):
+        while True:
+            lote = self._juntar()
+            try:
+                self._aplicar(lote)
+            except Exception:
+                log.exception("[%s] error inesperado", self.nombre)
+                for _, _, fut in lote:
+                    if not fut.done():
+                        fut.set_exception(RuntimeError("escritor agrupado falló"))
@@ -0,0 +1,28 @@
+import hashlib
+
+def etag(*parts, medio: str | None = None) -> str:
+    """
+    ETag fuerte a partir de partes simples: etag("p", 3, 7) -> '"p-3-7"'.
+    medio: media type de la representación; cada formato de la misma versión lleva su propio tag.
+    """
+    if medio:
+        parts += (medio.rsplit("/", 1)[-1],)
+    return '"' + "-".join(str(p) for p in parts) + '"'
+
+def huella(raw) -> str:
+    """Hash corto (SHA-1, 20 hex) para meter datos arbitrarios en un ETag."""
+    if isinstance(raw, str):
+        raw = raw.encode()
+    return hashlib.sha1(raw).hexdigest()[:20]
+
+def etag_lote(pares, medio: str | None = None) -> str:
+    """ETag de un lote de (id, version) en la representación medio; el orden de entrada no importa."""
+    raw = ",".join(f"{i}:{v}" for i, v in sorted(pares))
+    return '"l-' + huella(f"{medio}|{raw}" if medio else raw) + '"'
+
+def coincide(if_none_match: str | None, tag: str) -> bool:
+    """True si el header If-None-Match incluye tag (o es '*')."""
+    if not if_none_match:
+        return False
+    candidatos = [t.strip() for t in if_none_match.split(",")]
+    return "*" in candidatos or tag in candidatos
@@ -0,0 +1,130 @@
+import os
+import json
+
+from flask import Request, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import BadRequest
+
+# Dependencias opcionales: sin orjson se usa json de la stdlib; sin msgpack no se ofrece MessagePack
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+TIPOS_MSGPACK = (MSGPACK, "application/x-msgpack")
+
+# Formato de las llamadas entre servicios (pedidos -> productos/inventario/pagos): msgpack | json
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "msgpack" if msgpack is not None else "json")
+
+def es_msgpack(content_type) -> bool:
+    return (content_type or "").split(";", 1)[0].strip().lower() in TIPOS_MSGPACK
+
+def acepta_msgpack(accept) -> bool:
+    """True si el header Accept pide MessagePack antes que JSON (y msgpack está instalado)."""
+    if msgpack is None or not accept:
+        return False
+    mejor, tipo_mejor = -1.0, None
+    for parte in accept.split(","):
+        tipo, *params = [p.strip() for p in parte.split(";")]
+        q = 1.0
+        for p in params:
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if tipo.lower() in TIPOS_MSGPACK + (JSON,) and q > mejor:
+            mejor, tipo_mejor = q, tipo.lower()
+    return tipo_mejor in TIPOS_MSGPACK and mejor > 0
+
+def medio_respuesta() -> str:
+    """Media type con que sale la respuesta del request en curso (los ETags cambian con la representación)."""
+    if has_request_context() and acepta_msgpack(request.headers.get("Accept")):
+        return MSGPACK
+    return JSON
+
+def _default(o):
+    return DefaultJSONProvider.default(o)
+
+def dumps_json(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def loads_json(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def codificar(obj, tipo: str = JSON) -> bytes:
+    if es_msgpack(tipo):
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+    return dumps_json(obj)
+
+def decodificar(raw: bytes, tipo: str = JSON):
+    if es_msgpack(tipo):
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+    return loads_json(raw)
+
+def tipo_interno() -> str:
+    """Content-Type que pedidos usa para hablar con los demás servicios."""
+    return MSGPACK if WIRE_FORMAT == "msgpack" and msgpack is not None else JSON
+
+class ProveedorFormato(DefaultJSONProvider):
+    """
+    Serialización de las respuestas Flask (dicts devueltos y jsonify):
+    - MessagePack si el request lo pide en Accept;
+    - si no, JSON con orjson (o json de la stdlib), sin ordenar claves.
+    En debug la salida JSON sigue indentada, como en Flask.
+    """
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            kwargs.setdefault("sort_keys", self.sort_keys)
+            return super().dumps(obj, **kwargs)
+        return dumps_json(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if medio_respuesta() == MSGPACK:
+            obj = self._prepare_response_obj(args, kwargs)
+            resp = self._app.response_class(codificar(obj, MSGPACK), mimetype=MSGPACK)
+        elif self._app.debug:
+            resp = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            resp = self._app.response_class(dumps_json(obj) + b"\n", mimetype=self.mimetype)
+        resp.vary.add("Accept")
+        return resp
+
+class RequestFormato(Request):
+    """request.get_json() que también entiende bodies MessagePack."""
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if not es_msgpack(self.content_type):
+            return super().get_json(force=force, silent=silent, cache=cache)
+        try:
+            if msgpack is None:
+                raise ValueError("msgpack no está instalado")
+            return decodificar(self.get_data(cache=cache), MSGPACK)
+        except Exception as e:
+            if silent:
+                return None
+            raise BadRequest(f"Body MessagePack inválido: {e}")
+
+def negociar_formato(app):
+    """Content-Type/Accept en el servicio: JSON por defecto, MessagePack si el cliente lo pide."""
+    app.json = ProveedorFormato(app)
+    app.request_class = RequestFormato
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import sqlite3
+from functools import wraps
+
+from flask import request, make_response
+
+from common import formato
+from common.escritor import EscrituraIncierta
+
+log = logging.getLogger(__name__)
+
+TTL          = float(os.getenv("IDEMPOTENCIA_TTL", "86400"))   # cuánto se recuerda una respuesta
+EN_CURSO_TTL = float(os.getenv("IDEMPOTENCIA_EN_CURSO_TTL", "60"))  # lease mientras el request corre
+EN_CURSO_RETRY_AFTER = os.getenv("IDEMPOTENCIA_RETRY_AFTER", "1")   # segundos sugeridos al cliente (Retry-After)
+HEADERS_GUARDADOS = ("Content-Type", "Location", "ETag")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS idempotencia (
+        clave TEXT PRIMARY KEY,
+        huella TEXT NOT NULL,
+        status INTEGER,
+        body BLOB,
+        headers TEXT,
+        expira REAL NOT NULL
+    )
+"""
+
+class Idempotencia:
+    """
+    Header Idempotency-Key: la primera respuesta (no 5xx) se guarda y las repeticiones
+    la devuelven sin volver a ejecutar el handler (lookup por PK). El body se guarda como
+    JSON y sale en el formato que pida el Accept de cada repetición.
+    - Misma clave con otro body -> 422.
+    - Misma clave mientras el primero sigue corriendo -> 409 con Retry-After: el resultado
+      todavía no se conoce (distinto de un 409 del handler, que es definitivo).
+    - Si no se sabe si el handler escribió (EscrituraIncierta, o falló guardar la respuesta
+      tras su COMMIT) la clave no se libera: queda en curso hasta el TTL para no ejecutar dos veces.
+    """
+
+    def __init__(self, db, ttl: float = TTL, escritor=None):
+        self.db = db
+        self.ttl = ttl
+        # Con un EscritorAgrupado (common/escritor.py) las escrituras entran en su group commit
+        self.escritor = escritor
+
+    @staticmethod
+    def init_db(con):
+        con.execute(SCHEMA)
+        con.execute("CREATE INDEX IF NOT EXISTS idx_idempotencia_expira ON idempotencia (expira)")
+
+    @staticmethod
+    def huella(raw: bytes) -> str:
+        return hashlib.sha256(raw or b"").hexdigest()
+
+    def _escribir(self, fn, *args):
+        """fn(cursor, *args) en una transacción propia con BEGIN IMMEDIATE, o en el lote del escritor."""
+        if self.escritor is not None:
+            return self.escritor.ejecutar(fn, *args)
+        con = self.db.connection()
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            return fn(con.cursor(), *args)
+
+    def tomar(self, clave: str, huella: str):
+        """
+        Reserva la clave. Devuelve None si este request debe ejecutarse, o una
+        respuesta (status, body, headers) para devolver sin ejecutar nada.
+        """
+        return self._escribir(self._tomar, clave, huella)
+
+    @staticmethod
+    def _tomar(c, clave, huella):
+        ahora = time.time()
+        row = c.execute("SELECT huella, status, body, headers, expira FROM idempotencia WHERE clave=?",
+                        (clave,)).fetchone()
+        if row and row["expira"] > ahora:
+            if row["huella"] != huella:
+                return 422, json.dumps({"error": "Idempotency-Key reutilizada con otro body"}).encode(), {}
+            if row["status"] is None:
+                return 409, json.dumps({"error": "Request con esa Idempotency-Key en curso"}).encode(), \
+                    {"Retry-After": EN_CURSO_RETRY_AFTER}
+            headers = json.loads(row["headers"] or "{}")
+            headers["Idempotent-Replayed"] = "true"
+            return row["status"], row["body"], headers
+        c.execute("INSERT OR REPLACE INTO idempotencia (clave, huella, status, body, headers, expira) "
+                  "VALUES (?,?, NULL, NULL, NULL, ?)", (clave, huella, ahora + EN_CURSO_TTL))
+        # Limpieza perezosa de vencidas (usa el índice por expira)
+        if random.random() < 0.01:
+            c.execute("DELETE FROM idempotencia WHERE expira < ?", (ahora,))
+        return None
+
+    def guardar(self, clave: str, status: int, body: bytes, headers: dict):
+        if status >= 500:
+            # Fallo transitorio: se libera la clave para que el reintento se ejecute
+            return self.soltar(clave)
+        guardados = {k: v for k, v in headers.items() if k in HEADERS_GUARDADOS}
+        if formato.es_msgpack(guardados.get("Content-Type")):
+            # Se guarda el objeto (como JSON), no la representación: la repetición puede pedir otro Accept
+            body = formato.dumps_json(formato.decodificar(body, formato.MSGPACK))
+            guardados["Content-Type"] = formato.JSON
+        self._escribir(self._guardar, clave, status, sqlite3.Binary(body), json.dumps(guardados),
+                       time.time() + self.ttl)
+
+    @staticmethod
+    def _guardar(c, clave, status, body, headers, expira):
+        c.execute("UPDATE idempotencia SET status=?, body=?, headers=?, expira=? WHERE clave=?",
+                  (status, body, headers, expira, clave))
+
+    def incierta(self, clave: str):
+        """El resultado no se conoce: la clave sigue en curso (409) hasta el TTL en vez de liberarse."""
+        self._escribir(self._incierta, clave, time.time() + self.ttl)
+
+    @staticmethod
+    def _incierta(c, clave, expira):
+        c.execute("UPDATE idempotencia SET expira=? WHERE clave=? AND status IS NULL", (expira, clave))
+
+    def fallo(self, clave: str, e: Exception):
+        """El handler lanzó: se libera la clave, salvo que la escritura pueda haberse confirmado igual."""
+        if isinstance(e, EscrituraIncierta):
+            log.error("Idempotency-Key %s: resultado incierto (%s), la clave queda en curso", clave, e)
+            self.incierta(clave)
+        else:
+            self.soltar(clave)
+
+    def guardar_o_retener(self, clave: str, status: int, body: bytes, headers: dict):
+        """guardar() después de que el handler ya escribió: si falla, la respuesta sale igual."""
+        try:
+            self.guardar(clave, status, body, headers)
+        except Exception:
+            log.exception("Idempotency-Key %s: no se pudo guardar la respuesta", clave)
+            if status >= 500:
+                return
+            try:
+                self.incierta(clave)
+            except Exception:
+                log.exception("Idempotency-Key %s: tampoco se pudo retener la clave", clave)
+
+    def soltar(self, clave: str):
+        self._escribir(self._soltar, clave)
+
+    @staticmethod
+    def _soltar(c, clave):
+        c.execute("DELETE FROM idempotencia WHERE clave=?", (clave,))
+
+    def ejecutar(self, clave: str, data, fn):
+        """
+        Lo mismo que el decorador para una llamada en proceso (modo monolito): fn() -> (body, status).
+        Devuelve (body, status, headers), como una vista Flask.
+        """
+        previa = self.tomar(clave, self.huella(json.dumps(data, sort_keys=True).encode()))
+        if previa is not None:
+            status, body, headers = previa
+            return json.loads(bytes(body)), status, headers
+        try:
+            body, status = fn()
+        except Exception as e:
+            self.fallo(clave, e)
+            raise
+        self.guardar_o_retener(clave, status, json.dumps(body).encode(), {"Content-Type": "application/json"})
+        return body, status, {}
+
+    def __call__(self, fn):
+        """Decorador para vistas Flask."""
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            clave = request.headers.get("Idempotency-Key")
+            if not clave:
+                return fn(*args, **kwargs)
+            previa = self.tomar(clave, self.huella(request.get_data(cache=True)))
+            if previa is not None:
+                status, body, headers = previa
+                body = bytes(body)
+                tipo = headers.get("Content-Type", formato.JSON)
+                if body and tipo.startswith(formato.JSON) and formato.medio_respuesta() == formato.MSGPACK:
+                    body = formato.codificar(formato.loads_json(body), formato.MSGPACK)
+                    headers["Content-Type"] = formato.MSGPACK
+                resp = make_response(body, status)
+                resp.headers["Content-Type"] = formato.JSON
+                resp.headers.update(headers)
+                resp.vary.add("Accept")
+                return resp
+            try:
+                resp = make_response(fn(*args, **kwargs))
+            except Exception as e:
+                self.fallo(clave, e)
+                raise
+            self.guardar_o_retener(clave, resp.status_code, resp.get_data(), dict(resp.headers))
+            return resp
+        return wrapper
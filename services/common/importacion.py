@@ -0,0 +1,139 @@
+import os
+import csv
+import json
+import sqlite3
+import logging
+from itertools import islice
+
+log = logging.getLogger(__name__)
+
+IMPORT_LOTE        = int(os.getenv("IMPORT_LOTE", "1000"))        # filas por transacción
+IMPORT_MAX_ERRORES = int(os.getenv("IMPORT_MAX_ERRORES", "100"))  # errores detallados en la respuesta
+
+class FilaInvalida(ValueError):
+    """convertir() la lanza con el motivo; la fila se informa y el resto sigue."""
+
+def formato_de(req) -> str:
+    """?formato=csv|ndjson, o por Content-Type (NDJSON por defecto)."""
+    formato = req.args.get("formato")
+    if formato:
+        return formato
+    return "csv" if "text/csv" in (req.content_type or "") else "ndjson"
+
+def _lineas(stream, bloque: int = 64 * 1024):
+    """Líneas crudas (bytes) del body leyendo de a bloques (readline de un stream WSGI lee de a un byte)."""
+    resto = b""
+    while True:
+        datos = stream.read(bloque)
+        if not datos:
+            break
+        partes = (resto + datos).split(b"\n")
+        resto = partes.pop()
+        for linea in partes:
+            yield linea + b"\n"
+    if resto:
+        yield resto
+
+def _decodificadas(lineas, errores):
+    """Texto de cada línea; una que no es UTF-8 se anota en errores[n] y sigue como línea vacía."""
+    for n, linea in enumerate(lineas, 1):
+        try:
+            yield linea.decode("utf-8-sig" if n == 1 else "utf-8")
+        except UnicodeDecodeError as e:
+            errores[n] = FilaInvalida(f"UTF-8 inválido: {e}")
+            yield "\n"
+
+def leer_filas(stream, formato: str):
+    """
+    (número de línea, dict | Exception) a medida que llegan del body, sin cargarlo entero.
+    CSV: la primera línea es el encabezado. Las líneas vacías se saltean.
+    Una línea con bytes que no son UTF-8 sale como FilaInvalida, sin cortar la importación.
+    """
+    errores = {}
+    lineas = _decodificadas(_lineas(stream), errores)
+    if formato == "csv":
+        reader = csv.DictReader(lineas)
+        while True:
+            try:
+                fila = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                fila = FilaInvalida(f"CSV inválido: {e}")
+            # Las líneas mal codificadas llegan vacías al reader (que las saltea): se informan acá
+            for n in sorted(errores):
+                yield n, errores.pop(n)
+            yield reader.line_num, fila
+        for n in sorted(errores):
+            yield n, errores.pop(n)
+        return
+    if formato != "ndjson":
+        raise ValueError(f"formato no soportado: {formato}")
+    for n, linea in enumerate(lineas, 1):
+        if n in errores:
+            yield n, errores.pop(n)
+            continue
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except ValueError as e:
+            yield n, FilaInvalida(f"JSON inválido: {e}")
+            continue
+        yield n, fila if isinstance(fila, dict) else FilaInvalida("se esperaba un objeto")
+
+def importar(db, filas, convertir, escribir, lote: int = IMPORT_LOTE, max_errores: int = IMPORT_MAX_ERRORES) -> dict:
+    """
+    Carga masiva en transacciones de `lote` filas con memoria constante.
+    - convertir(dict) -> tupla de parámetros, o FilaInvalida.
+    - escribir(cursor, [tuplas]) hace el executemany del lote dentro de la transacción.
+    Si el lote falla en la DB se reintenta fila por fila (cada una en su SAVEPOINT),
+    así una fila mala no tira las demás. Devuelve el resumen con los primeros max_errores errores.
+    """
+    resumen = {"procesadas": 0, "importadas": 0, "con_error": 0, "errores": []}
+
+    def error(linea, motivo):
+        resumen["con_error"] += 1
+        if len(resumen["errores"]) < max_errores:
+            resumen["errores"].append({"linea": linea, "error": str(motivo)})
+
+    def validas(filas):
+        for linea, fila in filas:
+            resumen["procesadas"] += 1
+            try:
+                if isinstance(fila, Exception):
+                    raise fila
+                yield linea, convertir(fila)
+            except (FilaInvalida, KeyError, TypeError, ValueError) as e:
+                error(linea, e if isinstance(e, FilaInvalida) else f"fila inválida: {e!r}")
+
+    it = validas(filas)
+    con = db.connection()
+    while True:
+        chunk = list(islice(it, lote))
+        if not chunk:
+            break
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            c = con.cursor()
+            c.execute("SAVEPOINT lote")
+            try:
+                escribir(c, [p for _, p in chunk])
+                c.execute("RELEASE lote")
+                resumen["importadas"] += len(chunk)
+            except sqlite3.DatabaseError:
+                c.execute("ROLLBACK TO lote")
+                c.execute("RELEASE lote")
+                for linea, p in chunk:
+                    c.execute("SAVEPOINT fila")
+                    try:
+                        escribir(c, [p])
+                        resumen["importadas"] += 1
+                    except sqlite3.DatabaseError as e:
+                        c.execute("ROLLBACK TO fila")
+                        error(linea, e)
+                    c.execute("RELEASE fila")
+    if resumen["con_error"]:
+        log.warning("[importacion] %s de %s filas con error", resumen["con_error"], resumen["procesadas"])
+    resumen["errores_truncados"] = resumen["con_error"] > len(resumen["errores"])
+    return resumen
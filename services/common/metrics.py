@@ -0,0 +1,228 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+
+from flask import Response, g, request
+
+# Buckets en segundos (cubren desde una consulta SQLite hasta un timeout de red)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_METRICS = os.getenv("METRICS_SQL", "1") == "1"
+
+def _fmt_labels(names, values):
+    if not names:
+        return ""
+    pares = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(names, values))
+    return "{" + pares + "}"
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for lv, v in items:
+            yield f"{self.name}{_fmt_labels(self.labels, lv)} {v}"
+
+class Histogram:
+    """Histograma acumulativo estilo Prometheus; observe() es O(log buckets) con un lock corto."""
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}      # label_values -> [counts por bucket..., +Inf], sum
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            s[0][i] += 1
+            s[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(lv, list(s[0]), s[1]) for lv, s in self._series.items()]
+        for lv, counts, total in series:
+            acum = 0
+            for b, c in zip(self.buckets + (float("inf"),), counts):
+                acum += c
+                le = "+Inf" if b == float("inf") else repr(b)
+                yield f"{self.name}_bucket{_fmt_labels(self.labels + ('le',), lv + (le,))} {acum}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, lv)} {total}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, lv)} {acum}"
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels):
+        m = self._metrics.get(name)
+        if m is None:
+            with self._lock:
+                m = self._metrics.setdefault(name, cls(name, help, labels))
+        return m
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=()):
+        return self._get(Histogram, name, help, labels)
+
+    def render(self) -> str:
+        lines = []
+        for m in list(self._metrics.values()):
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "Latencia de requests por ruta",
+                                  ("service", "method", "route", "status"))
+SQL_SECONDS = REGISTRY.histogram("sqlite_query_duration_seconds", "Latencia de sentencias SQLite",
+                                 ("statement",))
+DEPENDENCY_SECONDS = REGISTRY.histogram("dependency_request_duration_seconds",
+                                        "Latencia de llamadas salientes por servicio destino",
+                                        ("dependency", "outcome"))
+
+def instrument_app(app, service: str):
+    """Mide cada request (ruta de Flask, no la URL, para acotar cardinalidad) y expone GET /metrics."""
+
+    @app.before_request
+    def _start_timer():
+        g._t0 = time.perf_counter()
+
+    @app.after_request
+    def _observe(resp):
+        t0 = g.pop("_t0", None)
+        if t0 is not None:
+            route = request.url_rule.rule if request.url_rule else "<sin_ruta>"
+            HTTP_SECONDS.observe(time.perf_counter() - t0, service, request.method, route, str(resp.status_code))
+        return resp
+
+    @app.get("/metrics")
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+# --- SQLite ---
+
+_IN_LIST = re.compile(r"\((\s*\?\s*,)+\s*\?\s*\)")
+
+@lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    """SQL normalizado como etiqueta: espacios colapsados, listas IN (?,?,...) unificadas."""
+    s = _IN_LIST.sub("(?...)", " ".join(sql.split()))
+    return s[:120]
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Mide cada sentencia completa: execute más los fetch/iteración hasta agotar el cursor
+    (en un SELECT SQLite hace casi todo el trabajo al ir pidiendo filas, no en execute).
+    La observación sale al agotarse, al cerrar el cursor o al reusarlo para otra sentencia.
+    """
+
+    _label = None
+    _acumulado = 0.0
+
+    def _observar(self):
+        if self._label is not None:
+            SQL_SECONDS.observe(self._acumulado, self._label)
+            self._label = None
+
+    def _medir(self, t0, abierto):
+        self._acumulado += time.perf_counter() - t0
+        if not abierto:
+            self._observar()
+
+    def execute(self, sql, params=()):
+        self._observar()
+        self._label, self._acumulado = statement_label(sql), 0.0
+        t0 = time.perf_counter()
+        abierto = False
+        try:
+            super().execute(sql, params)
+            abierto = self.description is not None
+            return self
+        finally:
+            self._medir(t0, abierto)
+
+    def executemany(self, sql, seq):
+        self._observar()
+        self._label, self._acumulado = statement_label(sql), 0.0
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            self._medir(t0, False)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = None
+        try:
+            row = super().fetchone()
+            return row
+        finally:
+            self._medir(t0, row is not None)
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = []
+        try:
+            rows = super().fetchmany(self.arraysize if size is None else size)
+            return rows
+        finally:
+            self._medir(t0, bool(rows))
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._medir(t0, False)
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        abierto = False
+        try:
+            row = super().__next__()
+            abierto = True
+            return row
+        finally:
+            self._medir(t0, abierto)
+
+    def close(self):
+        self._observar()
+        super().close()
+
+    def __del__(self):
+        self._observar()
+
+class TimedConnection(sqlite3.Connection):
+    """Conexión cuyos cursores (y execute directo) registran la duración de cada sentencia."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
@@ -0,0 +1,204 @@
+"""
+Trazas distribuidas con W3C Trace Context (header traceparent).
+Cada request abre un span de servidor que continúa el traceparent entrante (o empieza
+una traza nueva) y cada llamada saliente abre un span de cliente cuyo id viaja como
+traceparent al servicio destino. Los spans terminados se agregan a un JSONL local
+(TRACE_FILE); common/trazas.py reconstruye la cascada de un pedido.
+"""
+import os
+import re
+import json
+import time
+import random
+import secrets
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request
+
+TRACING      = os.getenv("TRACING", "1") == "1"
+TRACE_FILE   = os.getenv("TRACE_FILE", "spans.jsonl")
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "0.01"))  # fracción de trazas nuevas que se registran
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))   # rota el archivo al pasar este tamaño
+TRACE_BACKUPS   = int(os.getenv("TRACE_BACKUPS", "2"))                       # archivos rotados que se conservan (.1, .2...)
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_SIN_TRAZA = ("/health", "/metrics")
+
+_actual = ContextVar("span_actual", default=None)
+_servicio = "?"        # servicio por defecto para spans raíz fuera de un request
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "sampled", "service", "name", "kind",
+                 "attrs", "status", "start", "_t0")
+
+    def __init__(self, name, kind, service, trace_id, parent_id, sampled, attrs):
+        self.trace_id, self.parent_id, self.sampled = trace_id, parent_id, sampled
+        self.span_id = secrets.token_hex(8)
+        self.name, self.kind, self.service = name, kind, service
+        self.attrs = attrs
+        self.status = "ok"
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def registro(self, duracion) -> dict:
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "service": self.service, "name": self.name, "kind": self.kind, "start": round(self.start, 6),
+                "duration_ms": round(duracion * 1000, 3), "status": self.status, "attrs": self.attrs}
+
+class _SinkJsonl:
+    """
+    Un span por línea; el archivo se abre en el primer span (append, line-buffered).
+    Al pasar max_bytes se rota como los logs: path -> path.1 -> ... -> path.<backups>.
+    """
+
+    def __init__(self, path, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._f = None
+        self._lock = threading.Lock()
+
+    def write(self, rec):
+        line = json.dumps(rec, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            if self._f is None:
+                self._f = open(self.path, "a", encoding="utf-8", buffering=1)
+            elif self.max_bytes > 0 and self._f.tell() + len(line) > self.max_bytes:
+                self._rotar()
+            self._f.write(line)
+
+    def _rotar(self):
+        self._f.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._f = open(self.path, "a", encoding="utf-8", buffering=1)
+
+_sink = _SinkJsonl(TRACE_FILE)
+
+def parse_traceparent(valor):
+    """(trace_id, parent_id, sampled) o None si el header no es válido."""
+    m = _TRACEPARENT.match((valor or "").strip().lower())
+    if not m or m.group(1) == "0" * 32 or m.group(2) == "0" * 16:
+        return None
+    return m.group(1), m.group(2), bool(int(m.group(3), 16) & 1)
+
+def actual():
+    return _actual.get()
+
+def traceparent_actual():
+    s = _actual.get()
+    return s.traceparent() if s else None
+
+def anotar(**attrs):
+    """Agrega atributos al span en curso (p.ej. pedido_id, para buscar la traza después)."""
+    s = _actual.get()
+    if s is not None:
+        s.attrs.update(attrs)
+
+def iniciar(name, kind="internal", parent=None, service=None, **attrs) -> Span:
+    """
+    Crea un span sin activarlo. parent: traceparent a continuar; si falta o es inválido,
+    hijo del span en curso, o raíz de una traza nueva (muestreada con TRACE_SAMPLE).
+    """
+    padre = _actual.get()
+    ctx = parse_traceparent(parent) if parent else None
+    if ctx is not None:
+        trace_id, parent_id, sampled = ctx
+    elif padre is not None:
+        trace_id, parent_id, sampled = padre.trace_id, padre.span_id, padre.sampled
+    else:
+        trace_id, parent_id, sampled = secrets.token_hex(16), None, random.random() < TRACE_SAMPLE
+    svc = service or (padre.service if padre is not None else _servicio)
+    return Span(name, kind, svc, trace_id, parent_id, sampled and TRACING, attrs)
+
+def terminar(s: Span, error=None):
+    duracion = time.perf_counter() - s._t0
+    if error is not None:
+        if s.status == "ok":
+            s.status = "error"
+        s.attrs["error"] = type(error).__name__
+    if s.sampled:
+        try:
+            _sink.write(s.registro(duracion))
+        except OSError:
+            logging.getLogger(__name__).exception("No se pudo escribir el span en %s", TRACE_FILE)
+
+@contextmanager
+def span(name, kind="internal", parent=None, service=None, **attrs):
+    """Span activo mientras dura el bloque; si el bloque lanza, queda con status 'error'."""
+    s = iniciar(name, kind, parent, service, **attrs)
+    token = _actual.set(s)
+    error = None
+    try:
+        yield s
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _actual.reset(token)
+        terminar(s, error)
+
+@contextmanager
+def sin_muestrear(name="fondo"):
+    """
+    Tareas periódicas de fondo (poller de la caché de productos...): no abren una traza
+    registrada cada vez. Los spans del bloque, y los de los servicios que llame, heredan
+    sampled=False.
+    """
+    s = Span(name, "internal", _servicio, secrets.token_hex(16), None, False, {})
+    token = _actual.set(s)
+    try:
+        yield s
+    finally:
+        _actual.reset(token)
+
+def trace_app(app, service: str):
+    """Span de servidor por request (salvo /health y /metrics); la respuesta lleva X-Trace-Id."""
+    global _servicio
+    _servicio = service
+
+    @app.before_request
+    def _abrir_span():
+        rule = request.url_rule.rule if request.url_rule else "<sin_ruta>"
+        if rule in _SIN_TRAZA:
+            return
+        s = iniciar(f"{request.method} {rule}", "server", request.headers.get("traceparent"), service)
+        g._span, g._span_token = s, _actual.set(s)
+
+    @app.after_request
+    def _status(resp):
+        s = g.get("_span")
+        if s is not None:
+            s.status = resp.status_code
+            resp.headers["X-Trace-Id"] = s.trace_id
+        return resp
+
+    @app.teardown_request
+    def _cerrar_span(exc):
+        s = g.pop("_span", None)
+        if s is None:
+            return
+        _actual.reset(g.pop("_span_token"))
+        terminar(s, exc)
+
+# Cada línea de log lleva el trace_id del span en curso ("-" fuera de una traza)
+_fabrica_log = logging.getLogRecordFactory()
+
+def _record_con_traza(*args, **kwargs):
+    rec = _fabrica_log(*args, **kwargs)
+    s = _actual.get()
+    rec.trace_id = s.trace_id if s is not None else "-"
+    return rec
+
+logging.setLogRecordFactory(_record_con_traza)
@@ -0,0 +1,113 @@
+"""
+Cascada (waterfall) de una traza a partir de los spans.jsonl de cada servicio.
+
+    python services/common/trazas.py --pedido 42
+    python services/common/trazas.py --traza 4bf92f3577b34da6a3ce929d0e0e4736
+    python services/common/trazas.py --lentas 10
+
+Por defecto lee services/*/spans.jsonl (y los rotados); con --archivos se le pasan otros.
+"""
+import os
+import sys
+import json
+import glob
+import argparse
+from collections import defaultdict
+
+ANCHO = 40
+
+def cargar(archivos):
+    spans = []
+    for path in archivos:
+        with open(path, encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    spans.append(json.loads(linea))
+                except ValueError:
+                    continue   # línea cortada (proceso muerto a mitad de escritura)
+    return spans
+
+def trazas_de_pedido(spans, pedido_id):
+    """Trazas con un span anotado con ese pedido_id, la más reciente al final."""
+    marcados = [s for s in spans if str(s.get("attrs", {}).get("pedido_id")) == str(pedido_id)]
+    vistos = {}
+    for s in sorted(marcados, key=lambda s: s["start"]):
+        vistos.setdefault(s["trace_id"], s["start"])
+    return list(vistos)
+
+def etiqueta(s):
+    nombre = s["name"]
+    if s["kind"] == "client":
+        nombre += f" -> {s['attrs'].get('dependency', '?')}"
+    elif s["kind"] == "consumer":
+        nombre += f" (intento {s['attrs'].get('intento', '?')})"
+    return f"{s['service']:<11} {nombre} [{s['status']}]"
+
+def cascada(spans, trace_id, out=sys.stdout):
+    propios = [s for s in spans if s["trace_id"] == trace_id]
+    if not propios:
+        print(f"traza {trace_id}: sin spans", file=out)
+        return
+    ids = {s["span_id"] for s in propios}
+    hijos = defaultdict(list)
+    for s in propios:
+        hijos[s["parent_id"] if s["parent_id"] in ids else None].append(s)
+    for lista in hijos.values():
+        lista.sort(key=lambda s: s["start"])
+
+    t0 = min(s["start"] for s in propios)
+    fin = max(s["start"] + s["duration_ms"] / 1000 for s in propios)
+    total_ms = max((fin - t0) * 1000, 1e-3)
+    print(f"traza {trace_id}  {total_ms:.1f} ms, {len(propios)} spans", file=out)
+
+    def imprimir(s, nivel):
+        desde = (s["start"] - t0) * 1000
+        a = int(desde / total_ms * ANCHO)
+        b = max(a + 1, int((desde + s["duration_ms"]) / total_ms * ANCHO))
+        barra = " " * a + "#" * (min(b, ANCHO) - a)
+        print(f"{desde:9.1f} {s['duration_ms']:9.1f} ms |{barra:<{ANCHO}}| {'  ' * nivel}{etiqueta(s)}", file=out)
+        for h in hijos.get(s["span_id"], []):
+            imprimir(h, nivel + 1)
+
+    for raiz in hijos[None]:
+        imprimir(raiz, 0)
+
+def lentas(spans, n, out=sys.stdout):
+    """Las n trazas cuyo span raíz de servidor tardó más: por dónde empezar a mirar la cola."""
+    raices = [s for s in spans if s["kind"] == "server" and s["parent_id"] is None]
+    raices.sort(key=lambda s: s["duration_ms"], reverse=True)
+    for s in raices[:n]:
+        pedido = s.get("attrs", {}).get("pedido_id", "-")
+        print(f"{s['duration_ms']:9.1f} ms  {s['trace_id']}  {s['service']} {s['name']} [{s['status']}] "
+              f"pedido={pedido}", file=out)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Cascada de spans por pedido o por traza")
+    grupo = ap.add_mutually_exclusive_group(required=True)
+    grupo.add_argument("--pedido", type=int, help="id de pedido (usa la traza más reciente que lo creó)")
+    grupo.add_argument("--traza", help="trace_id (32 hex)")
+    grupo.add_argument("--lentas", type=int, metavar="N", help="lista las N trazas más lentas")
+    ap.add_argument("--archivos", nargs="+", help="spans.jsonl a leer (por defecto services/*/spans.jsonl*)")
+    args = ap.parse_args(argv)
+
+    base = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    # Incluye los rotados (spans.jsonl.1, .2...) que deja TRACE_MAX_BYTES
+    archivos = args.archivos or sorted(glob.glob(os.path.join(base, "*", "spans.jsonl*")))
+    spans = cargar(archivos)
+
+    if args.lentas:
+        lentas(spans, args.lentas)
+        return 0
+    if args.pedido is not None:
+        trazas = trazas_de_pedido(spans, args.pedido)
+        if not trazas:
+            print(f"No hay spans del pedido {args.pedido} en {len(archivos)} archivo(s)", file=sys.stderr)
+            return 1
+        trace_id = trazas[-1]
+    else:
+        trace_id = args.traza.lower()
+    cascada(spans, trace_id)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
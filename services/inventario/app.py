@@ -1,19 +1,47 @@
-import os, sqlite3, logging, datetime
+import os, sys, logging, datetime
 from functools import wraps
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 
 load_dotenv()
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.metrics import instrument_app
+from common.formato import negociar_formato
+from common.tracing import trace_app
+from common.db import Database
+from common.idempotencia import Idempotencia
+from common.escritor import EscritorAgrupado, Deshacer
+from common.importacion import FilaInvalida, formato_de, leer_filas, importar
+from barrido import BarridoReservas
+
 # Defaults simples para no romper si falta .env
 TOKEN   = os.getenv("SERVICE_TOKEN", "penguin-secret")
 PORT    = int(os.getenv("PORT", "5002"))
 DB_PATH = os.getenv("DB_PATH", "inventario.db")
 
+# Vencimiento de reservas y mantenimiento de la tabla (ver barrido.py)
+RESERVA_TTL        = float(os.getenv("RESERVA_TTL", "900"))          # s que una reserva puede quedar 'activa'
+BARRIDO_INTERVALO  = float(os.getenv("BARRIDO_INTERVALO", "30"))     # s entre pasadas (0 = sin hilo)
+BARRIDO_LOTE       = int(os.getenv("BARRIDO_LOTE", "500"))           # filas por transacción
+RESERVAS_RETENCION = float(os.getenv("RESERVAS_RETENCION_DIAS", "7"))  # días antes de archivar cerradas (0 = nunca)
+
+# Reservas por un único hilo escritor con group commit (ESCRITOR_* en common/escritor.py)
+RESERVAS_AGRUPADAS = os.getenv("RESERVAS_AGRUPADAS", "0") == "1"
+
 app = Flask(__name__)
-app.config["JSON_SORT_KEYS"] = False
+negociar_formato(app)
+
+db = Database(DB_PATH)
+db.init_app(app)
+instrument_app(app, "inventario")
+trace_app(app, "inventario")
+idempotente = Idempotencia(db)
+escritor = EscritorAgrupado(db, nombre="escritor-reservas")
+barrido = BarridoReservas(db, ttl=RESERVA_TTL, intervalo=BARRIDO_INTERVALO, lote=BARRIDO_LOTE,
+                          retencion=RESERVAS_RETENCION * 86400)
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(trace_id)s] %(message)s")
 log = logging.getLogger(__name__)
 
 def require_token(fn):
@@ -26,9 +54,7 @@ def require_token(fn):
     return wrapper
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db.connection()
 
 def init_db():
     with get_db() as con:
@@ -48,12 +74,17 @@ def init_db():
                 created_at TEXT NOT NULL
             )
         """)
+        BarridoReservas.init_db(con)
+        Idempotencia.init_db(con)
         con.commit()
 
 @app.get("/health")
 def health():
     return {"status": "ok", "service": "inventario"}
 
+SQL_UPSERT_STOCK = ("INSERT INTO stock (producto_id, cantidad) VALUES (?,?) "
+                    "ON CONFLICT(producto_id) DO UPDATE SET cantidad = excluded.cantidad")
+
 @app.post("/stock")
 @require_token
 def upsert_stock():
@@ -63,15 +94,26 @@ def upsert_stock():
     if not pid or cantidad is None:
         return {"error": "Faltan campos"}, 400
     with get_db() as con:
-        c = con.cursor()
-        row = c.execute("SELECT cantidad FROM stock WHERE producto_id=?", (pid,)).fetchone()
-        if row:
-            c.execute("UPDATE stock SET cantidad=? WHERE producto_id=?", (int(cantidad), pid))
-        else:
-            c.execute("INSERT INTO stock (producto_id, cantidad) VALUES (?,?)", (pid, int(cantidad)))
+        con.execute(SQL_UPSERT_STOCK, (pid, int(cantidad)))
         con.commit()
     return {"ok": True}
 
+@app.post("/stock/importar")
+@require_token
+def importar_stock():
+    """Carga masiva de stock en streaming: NDJSON o CSV con columnas producto_id, cantidad (fija el valor)."""
+    formato = formato_de(request)
+    if formato not in ("ndjson", "csv"):
+        return {"error": "formato debe ser ndjson o csv"}, 400
+    return importar(db, leer_filas(request.stream, formato), _stock_importado,
+                    lambda c, filas: c.executemany(SQL_UPSERT_STOCK, filas))
+
+def _stock_importado(fila):
+    pid, cantidad = int(fila.get("producto_id")), int(fila.get("cantidad"))
+    if pid <= 0 or cantidad < 0:
+        raise FilaInvalida("producto_id o cantidad inválidos")
+    return pid, cantidad
+
 @app.get("/stock/<int:pid>")
 @require_token
 def ver_stock(pid):
@@ -82,6 +124,80 @@ def ver_stock(pid):
         return {"producto_id": pid, "cantidad": 0}
     return dict(row)
 
+def begin_write(con):
+    """Abre la transacción tomando ya el lock de escritura (evita upgrades fallidos bajo carga)."""
+    con.execute("BEGIN IMMEDIATE")
+
+def _reservar(c, pid, cantidad):
+    """Descuenta stock y crea la reserva. Devuelve (reserva_id, None) o (None, disponible)."""
+    # Descuento condicional en una sola sentencia: nunca deja el stock negativo
+    cur = c.execute("UPDATE stock SET cantidad = cantidad - ? WHERE producto_id=? AND cantidad >= ?",
+                    (cantidad, pid, cantidad))
+    if cur.rowcount == 0:
+        row = c.execute("SELECT cantidad FROM stock WHERE producto_id=?", (pid,)).fetchone()
+        return None, int(row["cantidad"]) if row else 0
+    c.execute(
+        "INSERT INTO reservas (producto_id, cantidad, estado, created_at) VALUES (?,?, 'activa', ?)",
+        (pid, cantidad, datetime.datetime.utcnow().isoformat())
+    )
+    return c.lastrowid, None
+
+def _estado_previo(c, rid):
+    """Estado de una reserva que ya no está activa (puede estar archivada) o None si no existe."""
+    prev = c.execute("SELECT estado FROM reservas WHERE id=? "
+                     "UNION ALL SELECT estado FROM reservas_archivo WHERE id=?", (rid, rid)).fetchone()
+    return prev["estado"] if prev else None
+
+def _liberar(c, rid):
+    """Devuelve al stock una reserva activa. Devuelve el estado previo o None si no existe."""
+    res = c.execute("UPDATE reservas SET estado='liberada' WHERE id=? AND estado='activa' "
+                    "RETURNING producto_id, cantidad", (rid,)).fetchone()
+    if not res:
+        return _estado_previo(c, rid)
+    c.execute("INSERT INTO stock (producto_id, cantidad) VALUES (?,?) "
+              "ON CONFLICT(producto_id) DO UPDATE SET cantidad = cantidad + excluded.cantidad",
+              (res["producto_id"], int(res["cantidad"])))
+    return "activa"
+
+def _consumir(c, rid):
+    """Marca una reserva activa como consumida. Devuelve el estado previo o None si no existe."""
+    cur = c.execute("UPDATE reservas SET estado='consumida' WHERE id=? AND estado='activa'", (rid,))
+    if cur.rowcount == 0:
+        return _estado_previo(c, rid)
+    return "activa"
+
+def _reservar_todas(c, lineas):
+    """Reserva todas las líneas o ninguna. Sin stock: Deshacer((None, producto_id, disponible))."""
+    reservas = []
+    for pid, cantidad in lineas:
+        rid, disponible = _reservar(c, pid, cantidad)
+        if rid is None:
+            raise Deshacer((None, pid, disponible))
+        reservas.append({"reserva_id": rid, "producto_id": pid, "cantidad": cantidad})
+    return reservas, None, None
+
+def reservar_lineas(lineas):
+    """(reservas, None, None) o (None, producto_id, disponible), en transacción propia o en el lote del escritor."""
+    if RESERVAS_AGRUPADAS:
+        return escritor.ejecutar(_reservar_todas, lineas)
+    with get_db() as con:
+        c = con.cursor()
+        begin_write(con)
+        try:
+            return _reservar_todas(c, lineas)
+        except Deshacer as d:
+            con.rollback()
+            return d.resultado
+
+def _reserva_ids(data):
+    ids = data.get("reserva_ids")
+    if not isinstance(ids, list) or not ids:
+        return None
+    try:
+        return [int(x) for x in ids]
+    except (TypeError, ValueError):
+        return None
+
 @app.post("/reservar")
 @require_token
 def reservar():
@@ -90,21 +206,39 @@ def reservar():
     cantidad = int(data.get("cantidad") or 0)
     if not pid or cantidad <= 0:
         return {"error": "Faltan campos"}, 400
-    with get_db() as con:
-        c = con.cursor()
-        row = c.execute("SELECT cantidad FROM stock WHERE producto_id=?", (pid,)).fetchone()
-        actual = int(row["cantidad"]) if row else 0
-        if actual < cantidad:
-            return {"error": "Stock insuficiente", "disponible": actual}, 409
-        nuevo = actual - cantidad
-        c.execute(
-            "INSERT INTO reservas (producto_id, cantidad, estado, created_at) VALUES (?,?, 'activa', ?)",
-            (pid, cantidad, datetime.datetime.utcnow().isoformat())
-        )
-        rid = c.lastrowid
-        c.execute("REPLACE INTO stock (producto_id, cantidad) VALUES (?,?)", (pid, nuevo))
-        con.commit()
-    return {"reserva_id": rid, "producto_id": pid, "cantidad": cantidad}
+    reservas, _, disponible = reservar_lineas([(pid, cantidad)])
+    if reservas is None:
+        return {"error": "Stock insuficiente", "disponible": disponible}, 409
+    return reservas[0]
+
+@app.post("/reservas/lote")
+@require_token
+@idempotente
+def reservar_lote():
+    """Reserva todas las líneas de un pedido en una sola transacción (todo o nada)."""
+    data = request.get_json(silent=True) or {}
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return {"error": "Faltan items"}, 400
+    lineas = []
+    for it in items:
+        try:
+            pid = int(it.get("producto_id"))
+            cantidad = int(it.get("cantidad"))
+        except (AttributeError, TypeError, ValueError):
+            return {"error": "Items inválidos"}, 400
+        if pid <= 0 or cantidad <= 0:
+            return {"error": "Items inválidos"}, 400
+        lineas.append((pid, cantidad))
+
+    return reservas_lote(lineas)
+
+def reservas_lote(lineas):
+    """Todas las líneas (producto_id, cantidad) o ninguna -> (body, status)."""
+    reservas, pid, disponible = reservar_lineas(lineas)
+    if reservas is None:
+        return {"error": "Stock insuficiente", "producto_id": pid, "disponible": disponible}, 409
+    return {"reservas": reservas}, 200
 
 @app.post("/liberar")
 @require_token
@@ -115,19 +249,32 @@ def liberar():
         return {"error": "Falta reserva_id"}, 400
     with get_db() as con:
         c = con.cursor()
-        res = c.execute("SELECT id, producto_id, cantidad, estado FROM reservas WHERE id=?", (rid,)).fetchone()
-        if not res:
+        begin_write(con)
+        previo = _liberar(c, rid)
+        if previo is None:
             return {"error": "Reserva no existe"}, 404
-        if res["estado"] != "activa":
-            return {"ok": True, "detalle": f"Reserva ya {res['estado']}"}
-        row = c.execute("SELECT cantidad FROM stock WHERE producto_id=?", (res["producto_id"],)).fetchone()
-        actual = int(row["cantidad"]) if row else 0
-        nuevo = actual + int(res["cantidad"])
-        c.execute("REPLACE INTO stock (producto_id, cantidad) VALUES (?,?)", (res["producto_id"], nuevo))
-        c.execute("UPDATE reservas SET estado='liberada' WHERE id=?", (rid,))
+        if previo != "activa":
+            return {"ok": True, "detalle": f"Reserva ya {previo}"}
         con.commit()
     return {"ok": True}
 
+@app.post("/liberar/lote")
+@require_token
+def liberar_lote():
+    data = request.get_json(silent=True) or {}
+    ids = _reserva_ids(data)
+    if ids is None:
+        return {"error": "Falta reserva_ids"}, 400
+    return liberar_ids(ids)
+
+def liberar_ids(ids):
+    with get_db() as con:
+        c = con.cursor()
+        begin_write(con)
+        resultado = {rid: _liberar(c, rid) for rid in ids}
+        con.commit()
+    return {"ok": True, "no_encontradas": [rid for rid, prev in resultado.items() if prev is None]}
+
 @app.post("/consumir")
 @require_token
 def consumir():
@@ -137,15 +284,45 @@ def consumir():
         return {"error": "Falta reserva_id"}, 400
     with get_db() as con:
         c = con.cursor()
-        res = c.execute("SELECT id, estado FROM reservas WHERE id=?", (rid,)).fetchone()
-        if not res:
+        begin_write(con)
+        previo = _consumir(c, rid)
+        if previo is None:
             return {"error": "Reserva no existe"}, 404
-        if res["estado"] != "activa":
-            return {"ok": True, "detalle": f"Reserva ya {res['estado']}"}
-        c.execute("UPDATE reservas SET estado='consumida' WHERE id=?", (rid,))
+        if previo != "activa":
+            return {"ok": True, "detalle": f"Reserva ya {previo}"}
         con.commit()
     return {"ok": True}
 
-if __name__ == "__main__":
+@app.post("/consumir/lote")
+@require_token
+def consumir_lote():
+    data = request.get_json(silent=True) or {}
+    ids = _reserva_ids(data)
+    if ids is None:
+        return {"error": "Falta reserva_ids"}, 400
+    return consumir_ids(ids)
+
+def consumir_ids(ids):
+    with get_db() as con:
+        c = con.cursor()
+        begin_write(con)
+        resultado = {rid: _consumir(c, rid) for rid in ids}
+        con.commit()
+    # liberadas: vencieron (o se liberaron) antes de consumirse, su stock ya volvió
+    return {"ok": True, "no_encontradas": [rid for rid, prev in resultado.items() if prev is None],
+            "liberadas": [rid for rid, prev in resultado.items() if prev == "liberada"]}
+
+@app.post("/reservas/barrer")
+@require_token
+def barrer():
+    """Pasada manual del barrido: libera vencidas y archiva cerradas viejas."""
+    return barrido.pasada()
+
+def create_app():
+    """Fábrica para servidores WSGI (serve.py): esquema y barrido de reservas, una vez por proceso."""
     init_db()
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    barrido.ensure_worker()
+    return app
+
+if __name__ == "__main__":
+    create_app().run(host="0.0.0.0", port=PORT, debug=True)
@@ -0,0 +1,124 @@
+import time
+import logging
+import datetime
+import threading
+from collections import defaultdict
+
+log = logging.getLogger(__name__)
+
+SCHEMA_ARCHIVO = """
+    CREATE TABLE IF NOT EXISTS reservas_archivo (
+        id INTEGER PRIMARY KEY,
+        producto_id INTEGER NOT NULL,
+        cantidad INTEGER NOT NULL,
+        estado TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        archivada_at TEXT NOT NULL
+    )
+"""
+
+def _hace(segundos: float) -> str:
+    """Instante UTC en el mismo formato ISO que reservas.created_at (comparable como texto)."""
+    return (datetime.datetime.utcnow() - datetime.timedelta(seconds=segundos)).isoformat()
+
+class BarridoReservas:
+    """
+    Hilo de mantenimiento de la tabla reservas.
+    - Reservas 'activa' más viejas que ttl (pedidos se cayó entre reservar y consumir/liberar)
+      se liberan y su stock vuelve, en lotes de `lote` filas por transacción.
+    - Reservas 'consumida'/'liberada' más viejas que retencion pasan a reservas_archivo,
+      así la tabla viva sólo tiene lo reciente (retencion=0 lo desactiva).
+    Ambos recorren el índice (estado, created_at); cada lote es una transacción corta
+    con BEGIN IMMEDIATE, así no bloquea a /reservar más que un par de milisegundos.
+    """
+
+    def __init__(self, db, ttl=900.0, intervalo=30.0, lote=500, retencion=7 * 86400.0):
+        self.db = db
+        self.ttl = ttl
+        self.intervalo = intervalo
+        self.lote = lote
+        self.retencion = retencion
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def init_db(con):
+        con.execute("CREATE INDEX IF NOT EXISTS idx_reservas_estado_created ON reservas (estado, created_at)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_reservas_producto ON reservas (producto_id)")
+        con.execute(SCHEMA_ARCHIVO)
+
+    def ensure_worker(self):
+        with self._lock:
+            if self.intervalo <= 0 or (self._hilo is not None and self._hilo.is_alive()):
+                return
+            self._hilo = threading.Thread(target=self._loop, name="barrido-reservas", daemon=True)
+            self._hilo.start()
+
+    def liberar_vencidas(self) -> int:
+        """Libera las reservas activas vencidas. Devuelve cuántas liberó."""
+        total = 0
+        while True:
+            n = self._liberar_lote(_hace(self.ttl))
+            total += n
+            if n < self.lote:
+                return total
+
+    def archivar(self) -> int:
+        """Mueve a reservas_archivo las reservas cerradas fuera de la retención. Devuelve cuántas movió."""
+        if self.retencion <= 0:
+            return 0
+        total = 0
+        for estado in ("consumida", "liberada"):
+            while True:
+                n = self._archivar_lote(estado, _hace(self.retencion))
+                total += n
+                if n < self.lote:
+                    break
+        return total
+
+    def pasada(self) -> dict:
+        return {"liberadas": self.liberar_vencidas(), "archivadas": self.archivar()}
+
+    # --- internos ---
+
+    def _liberar_lote(self, limite: str) -> int:
+        con = self.db.connection()
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            filas = con.execute(
+                """UPDATE reservas SET estado='liberada'
+                   WHERE id IN (SELECT id FROM reservas WHERE estado='activa' AND created_at < ?
+                                ORDER BY created_at LIMIT ?)
+                   RETURNING producto_id, cantidad""", (limite, self.lote)).fetchall()
+            devolver = defaultdict(int)
+            for f in filas:
+                devolver[f["producto_id"]] += int(f["cantidad"])
+            con.executemany("INSERT INTO stock (producto_id, cantidad) VALUES (?,?) "
+                            "ON CONFLICT(producto_id) DO UPDATE SET cantidad = cantidad + excluded.cantidad",
+                            list(devolver.items()))
+        if filas:
+            log.warning("[barrido] %s reservas vencidas liberadas (%s productos)", len(filas), len(devolver))
+        return len(filas)
+
+    def _archivar_lote(self, estado: str, limite: str) -> int:
+        con = self.db.connection()
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            ids = [r[0] for r in con.execute(
+                "SELECT id FROM reservas WHERE estado=? AND created_at < ? ORDER BY created_at LIMIT ?",
+                (estado, limite, self.lote))]
+            if ids:
+                marcas = ",".join("?" * len(ids))
+                con.execute(f"INSERT OR REPLACE INTO reservas_archivo "
+                            f"SELECT id, producto_id, cantidad, estado, created_at, ? FROM reservas WHERE id IN ({marcas})",
+                            (datetime.datetime.utcnow().isoformat(), *ids))
+                con.execute(f"DELETE FROM reservas WHERE id IN ({marcas})", ids)
+        return len(ids)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.pasada()
+            except Exception:
+                log.exception("[barrido] error en la pasada")
@@ -0,0 +1,148 @@
+"""
+Modo monolito: los cuatro servicios en un solo proceso (un intérprete en vez de cuatro).
+
+    python monolito.py               # servidor de desarrollo en MONOLITO_PORT (5000)
+    python serve.py monolito         # gunicorn / waitress, igual que un servicio suelto
+
+- Cada <servicio>/app.py se carga tal cual, con su propia DB (<SERVICIO>_DB_PATH o
+  <servicio>/<servicio>.db), bajo un nombre de módulo propio.
+- Un despachador WSGI manda cada request a la app dueña del primer segmento de la ruta
+  (/productos -> productos, /reservar -> inventario, /pagar -> pagos, /pedidos -> pedidos).
+- pedidos llama a productos, inventario y pagos con funciones en proceso en vez de HTTP
+  (http_client.LOCALES): sin sockets, sin serializar JSON, sin token ni breaker.
+El mismo código sigue corriendo como cuatro servicios separados.
+"""
+import os
+import sys
+import json
+import importlib.util
+
+SERVICES = os.path.dirname(os.path.abspath(__file__))
+SERVICIOS = ("productos", "inventario", "pagos", "pedidos")
+
+PORT = int(os.getenv("MONOLITO_PORT", "5000"))
+
+def cargar(svc: str):
+    """Importa <svc>/app.py como módulo <svc>_app, con el DB_PATH de ese servicio."""
+    carpeta = os.path.join(SERVICES, svc)
+    previo = dict(os.environ)
+    os.environ["DB_PATH"] = os.getenv(f"{svc.upper()}_DB_PATH", os.path.join(carpeta, f"{svc}.db"))
+    sys.path.insert(0, carpeta)
+    try:
+        spec = importlib.util.spec_from_file_location(f"{svc}_app", os.path.join(carpeta, "app.py"))
+        mod = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = mod
+        spec.loader.exec_module(mod)
+    finally:
+        sys.path.remove(carpeta)
+        # Lo que cada app.py leyó de su .env ya quedó en sus constantes; no se filtra al siguiente
+        os.environ.clear()
+        os.environ.update(previo)
+    return mod
+
+MODULOS = {svc: cargar(svc) for svc in SERVICIOS}
+productos, inventario, pagos, pedidos = (MODULOS[s] for s in SERVICIOS)
+
+from common import formato                          # noqa: E402
+from http_client import RespuestaLocal, registrar_local   # noqa: E402
+
+# --- Llamadas en proceso: (método, ruta) -> función del servicio ---
+
+def _productos_ids(body, params, headers):
+    ids = {int(x) for x in str(params["ids"]).split(",") if x.strip()}
+    # Mismo ETag que por HTTP: pedidos lo arma con su formato de red
+    return productos.productos_por_ids(ids, headers.get("If-None-Match"), formato.tipo_interno())
+
+def _productos_cambios(body, params, headers):
+    return productos.cambios_desde(int(params.get("desde", 0)), int(params.get("limit", 1000)))
+
+def _reservas_lote(body, params, headers):
+    return inventario.reservas_lote([(int(it["producto_id"]), int(it["cantidad"])) for it in body["items"]])
+
+def _liberar_lote(body, params, headers):
+    return inventario.liberar_ids([int(x) for x in body["reserva_ids"]])
+
+def _consumir_lote(body, params, headers):
+    return inventario.consumir_ids([int(x) for x in body["reserva_ids"]])
+
+def _pagar(body, params, headers):
+    # La clave sigue valiendo en proceso: la liquidación diferida reintenta tras una caída
+    clave = headers.get("Idempotency-Key")
+    if not clave:
+        return pagos.registrar_pago(body)
+    return pagos.idempotente.ejecutar(clave, body, lambda: (pagos.registrar_pago(body), 200))
+
+RUTAS = {
+    "productos": {("GET", "/productos"): _productos_ids, ("GET", "/productos/cambios"): _productos_cambios},
+    "inventario": {("POST", "/reservas/lote"): _reservas_lote, ("POST", "/liberar/lote"): _liberar_lote,
+                   ("POST", "/consumir/lote"): _consumir_lote},
+    "pagos": {("POST", "/pagar"): _pagar},
+}
+
+def _respuesta(resultado) -> RespuestaLocal:
+    """body | (body, status) | (body, status, headers), como lo devuelven las vistas Flask."""
+    if isinstance(resultado, dict):
+        return RespuestaLocal(200, resultado)
+    body, status, *resto = resultado
+    return RespuestaLocal(status, body if body != "" else None, resto[0] if resto else {})
+
+def _por_wsgi(mod, method, path, body, params, headers) -> RespuestaLocal:
+    """Rutas sin función directa: la app Flask en proceso, sin socket."""
+    hdrs = {**headers, "Authorization": f"Bearer {mod.TOKEN}"}
+    r = mod.app.test_client().open(path, method=method, json=body, query_string=params, headers=hdrs)
+    return RespuestaLocal(r.status_code, r.get_json(silent=True), dict(r.headers))
+
+def _handler(svc):
+    mod, rutas = MODULOS[svc], RUTAS[svc]
+
+    def handler(method, path, json=None, params=None, headers=None):
+        params, headers = params or {}, headers or {}
+        fn = rutas.get((method, path))
+        if fn is _productos_ids and "ids" not in params:
+            fn = None
+        if fn is None:
+            return _por_wsgi(mod, method, path, json, params, headers)
+        try:
+            return _respuesta(fn(json or {}, params, headers))
+        finally:
+            mod.db.release()     # la conexión vuelve al pool del servicio, como en su teardown
+    return handler
+
+for _svc in RUTAS:
+    registrar_local(_svc, _handler(_svc))
+
+# --- WSGI ---
+
+class Despachador:
+    """Cada request va a la app dueña del primer segmento de la ruta; /metrics es común a todas."""
+
+    def __init__(self, apps: dict, por_defecto):
+        self.por_defecto = por_defecto
+        self.rutas = {}
+        for app in apps.values():
+            for rule in app.url_map.iter_rules():
+                seg = rule.rule.strip("/").split("/", 1)[0]
+                if seg and not seg.startswith("<") and seg not in ("health", "metrics", "static"):
+                    self.rutas.setdefault(seg, app)
+
+    def __call__(self, environ, start_response):
+        seg = environ.get("PATH_INFO", "").strip("/").split("/", 1)[0]
+        if seg == "health":
+            body = json.dumps({"status": "ok", "service": "monolito", "servicios": list(SERVICIOS)}).encode()
+            start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+            return [body]
+        return self.rutas.get(seg, self.por_defecto)(environ, start_response)
+
+def init_db():
+    for mod in MODULOS.values():
+        mod.init_db()
+
+def create_app():
+    """Fábrica WSGI (serve.py): cada servicio hace su create_app() y quedan detrás del despachador."""
+    for mod in MODULOS.values():
+        mod.create_app()
+    return Despachador({svc: mod.app for svc, mod in MODULOS.items()}, pedidos.app)
+
+if __name__ == "__main__":
+    from werkzeug.serving import run_simple
+    run_simple("0.0.0.0", PORT, create_app(), threaded=True)
@@ -1,19 +1,37 @@
-import os, sqlite3, logging, datetime
+import os, sys, logging, datetime
 from functools import wraps
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 
 load_dotenv()
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.metrics import instrument_app
+from common.formato import negociar_formato
+from common.tracing import trace_app
+from common.db import Database
+from common.idempotencia import Idempotencia
+from common.escritor import EscritorAgrupado
+
 # Defaults simples (evitan NoneType si falta .env)
 TOKEN   = os.getenv("SERVICE_TOKEN", "penguin-secret")
 PORT    = int(os.getenv("PORT", "5004"))
 DB_PATH = os.getenv("DB_PATH", "pagos.db")
 
+# Altas de pagos (y claves de idempotencia) por un único hilo escritor con group commit (ESCRITOR_*)
+PAGOS_AGRUPADOS = os.getenv("PAGOS_AGRUPADOS", "0") == "1"
+
 app = Flask(__name__)
-app.config["JSON_SORT_KEYS"] = False
+negociar_formato(app)
+
+db = Database(DB_PATH)
+db.init_app(app)
+instrument_app(app, "pagos")
+trace_app(app, "pagos")
+escritor = EscritorAgrupado(db, nombre="escritor-pagos")
+idempotente = Idempotencia(db, escritor=escritor if PAGOS_AGRUPADOS else None)
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(trace_id)s] %(message)s")
 log = logging.getLogger(__name__)
 
 def require_token(fn):
@@ -26,9 +44,7 @@ def require_token(fn):
     return wrapper
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db.connection()
 
 def init_db():
     with get_db() as con:
@@ -44,6 +60,7 @@ def init_db():
                 created_at TEXT NOT NULL
             )
         """)
+        Idempotencia.init_db(con)
         con.commit()
 
 @app.get("/health")
@@ -52,8 +69,11 @@ def health():
 
 @app.post("/pagar")
 @require_token
+@idempotente
 def pagar():
-    data = request.get_json(silent=True) or {}
+    return registrar_pago(request.get_json(silent=True) or {})
+
+def registrar_pago(data):
     monto = float(data.get("monto") or 0)
     moneda = data.get("moneda") or "PYG"
     medio = data.get("medio") or "tarjeta"
@@ -61,17 +81,25 @@ def pagar():
     fail = bool(data.get("fail", False))
     estado = "rechazado" if fail else "aprobado"
 
-    with get_db() as con:
-        c = con.cursor()
-        c.execute(
-            "INSERT INTO pagos (monto, moneda, medio, referencia, estado, created_at) VALUES (?,?,?,?,?,?)",
-            (monto, moneda, medio, referencia, estado, datetime.datetime.utcnow().isoformat())
-        )
-        con.commit()
-        pid = c.lastrowid
+    fila = (monto, moneda, medio, referencia, estado, datetime.datetime.utcnow().isoformat())
+    if PAGOS_AGRUPADOS:
+        # El id vuelve recién después del COMMIT del lote
+        pid = escritor.ejecutar(insertar_pago, fila)
+    else:
+        with get_db() as con:
+            pid = insertar_pago(con.cursor(), fila)
+            con.commit()
 
     return {"pago_id": pid, "estado": estado}
 
-if __name__ == "__main__":
+def insertar_pago(c, fila):
+    c.execute("INSERT INTO pagos (monto, moneda, medio, referencia, estado, created_at) VALUES (?,?,?,?,?,?)", fila)
+    return c.lastrowid
+
+def create_app():
+    """Fábrica para servidores WSGI (serve.py): prepara el esquema una vez por proceso."""
     init_db()
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    return app
+
+if __name__ == "__main__":
+    create_app().run(host="0.0.0.0", port=PORT, debug=True)
@@ -1,4 +1,4 @@
-import os, sqlite3, logging, datetime
+import os, sys, time, uuid, logging, datetime
 from functools import wraps
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
@@ -7,6 +7,20 @@ import requests
 
 load_dotenv()
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.metrics import instrument_app
+from common.formato import negociar_formato, medio_respuesta, tipo_interno
+from common.tracing import trace_app, anotar, traceparent_actual, sin_muestrear
+from common.db import Database, add_column_if_missing
+from common.etag import etag, etag_lote, coincide
+from common.idempotencia import Idempotencia
+from common.escritor import EscritorAgrupado
+import http_client
+from http_client import request_json
+from product_cache import ProductCache
+from cola import ColaTrabajos
+import ventas
+
 TOKEN = os.getenv("SERVICE_TOKEN", "penguin-secret")
 PORT = int(os.getenv("PORT", "5003"))
 DB_PATH = os.getenv("DB_PATH", "pedidos.db")   
@@ -15,10 +29,35 @@ PRODUCTS_URL  = os.getenv("PRODUCTS_URL",  "http://127.0.0.1:5001")
 INVENTORY_URL = os.getenv("INVENTORY_URL", "http://127.0.0.1:5002")
 PAYMENTS_URL  = os.getenv("PAYMENTS_URL",  "http://127.0.0.1:5004") 
 
+# Pago diferido: responder 202 y liquidar (pago + consumir/liberar) en segundo plano
+PAGO_ASYNC               = os.getenv("PAGO_ASYNC", "0") == "1"   # si no, por request con "Prefer: respond-async"
+LIQUIDACION_WORKERS      = int(os.getenv("LIQUIDACION_WORKERS", "2"))
+LIQUIDACION_MAX_INTENTOS = int(os.getenv("LIQUIDACION_MAX_INTENTOS", "5"))
+
+# Altas de pedidos (y claves de idempotencia) por un único hilo escritor con group commit (ESCRITOR_*)
+PEDIDOS_AGRUPADOS = os.getenv("PEDIDOS_AGRUPADOS", "0") == "1"
+
+# Las llamadas salen por http_client.request_json: sesiones keep-alive (HTTP_POOL_*),
+# circuit breaker (CB_*) y reintentos con backoff exponencial + presupuesto (RETRY_*)
+PEDIDO_TIMEOUT = float(os.getenv("PEDIDO_TIMEOUT", "10"))   # deadline total de la saga síncrona (s)
+
+PAGE_SIZE     = int(os.getenv("PAGE_SIZE", "50"))      # página por defecto de GET /pedidos
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+
+# Caché de productos (PRODUCT_CACHE_*), invalidada por el feed /productos/cambios
+productos_cache = ProductCache()
+
 app = Flask(__name__)
-app.config["JSON_SORT_KEYS"] = False
+negociar_formato(app)
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+db = Database(DB_PATH)
+db.init_app(app)
+instrument_app(app, "pedidos")
+trace_app(app, "pedidos")
+escritor = EscritorAgrupado(db, nombre="escritor-pedidos")
+idempotente = Idempotencia(db, escritor=escritor if PEDIDOS_AGRUPADOS else None)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(trace_id)s] %(message)s")
 log = logging.getLogger(__name__)
 
 def require_token(fn):
@@ -31,9 +70,7 @@ def require_token(fn):
     return wrapper
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db.connection()
 
 def init_db():
     with get_db() as con:
@@ -46,6 +83,9 @@ def init_db():
                 created_at TEXT NOT NULL
             )
         """)
+        add_column_if_missing(con, "pedidos", "version", "INTEGER NOT NULL DEFAULT 1")
+        ColaTrabajos.init_db(con)
+        Idempotencia.init_db(con)
         c.execute("""
             CREATE TABLE IF NOT EXISTS items (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -55,113 +95,390 @@ def init_db():
                 precio_unit REAL NOT NULL
             )
         """)
+        ventas.init_db(con)
         con.commit()
 
 def auth_headers():
     return {"Authorization": f"Bearer {TOKEN}"}
 
-@app.get("/health")
-def health():
-    return {"status": "ok", "service": "pedidos"}
-
-@app.post("/pedidos")
-@require_token
-def crear_pedido():
-    data = request.get_json(silent=True) or {}
-    items = data.get("items") or []
-    pago = data.get("pago") or {}
+def liberar_reservas(reservas):
+    """Compensación: devuelve al stock las reservas del pedido en una sola llamada."""
+    if not reservas:
+        return
+    try:
+        request_json("POST", f"{INVENTORY_URL}/liberar/lote", "inventario",
+                     json={"reserva_ids": reservas}, idempotent=True)
+    except Exception:
+        log.exception("Error liberando reservas %s", reservas)
 
+def parse_lineas(items):
+    """Valida los items del body. Devuelve (lineas, None) o (None, respuesta_error)."""
     if not items:
-        return {"error": "Debes enviar items"}, 400
-
-    detalle = []
-    total = 0.0
+        return None, ({"error": "Debes enviar items"}, 400)
+    lineas = []
     for it in items:
         try:
             producto_id = int(it.get("producto_id"))
             cantidad = int(it.get("cantidad"))
-        except (TypeError, ValueError):
-            return {"error": "Items inválidos"}, 400
+        except (AttributeError, TypeError, ValueError):
+            return None, ({"error": "Items inválidos"}, 400)
         if producto_id <= 0 or cantidad <= 0:
-            return {"error": "Items inválidos"}, 400
+            return None, ({"error": "Items inválidos"}, 400)
+        lineas.append((producto_id, cantidad))
+    return lineas, None
 
-        r = requests.get(f"{PRODUCTS_URL}/productos/{producto_id}", headers=auth_headers(), timeout=5)
-        if r.status_code != 200:
-            return {"error": f"Producto {producto_id} no encontrado"}, 400
-        prod = r.json()
+def ids_param(ids):
+    return ",".join(str(pid) for pid in sorted(ids))
+
+def fetch_cambios(desde):
+    # Lo llama el poller de la caché cada PRODUCT_CACHE_POLL segundos: no abre trazas propias
+    with sin_muestrear("poll cambios"):
+        r = request_json("GET", f"{PRODUCTS_URL}/productos/cambios", "productos", params={"desde": desde}, retries=0)
+    r.raise_for_status()
+    return r.json()
+
+def revalidacion(faltantes):
+    """Headers para pedir faltantes: si todos están vencidos en caché, se revalidan por ETag. Devuelve (headers, vencidos)."""
+    headers = {}
+    vencidos = productos_cache.stale(faltantes)
+    if vencidos and len(vencidos) == len(faltantes):
+        # El lote se pide en el formato de red (WIRE_FORMAT), que es parte del ETag
+        headers["If-None-Match"] = etag_lote([(pid, p.get("version", 0)) for pid, p in vencidos.items()],
+                                             tipo_interno())
+    return headers, vencidos
+
+def items_revalidados(status_code, body, vencidos):
+    """Items de la respuesta de /productos?ids= (304 = los vencidos siguen valiendo) o None si falló."""
+    if status_code == 304:
+        items = list(vencidos.values())
+    elif status_code == 200:
+        items = body().get("items", [])
+    else:
+        return None
+    productos_cache.put_many(items)
+    return items
+
+def obtener_productos(lineas, deadline=None):
+    """{id: producto} para el carrito; sólo los que no están en caché viajan (en una llamada) a productos."""
+    productos_cache.ensure_poller(fetch_cambios)
+    productos, faltantes = productos_cache.get_many({pid for pid, _ in lineas})
+    if not faltantes:
+        return productos, None
+    headers, vencidos = revalidacion(faltantes)
+    try:
+        r = request_json("GET", f"{PRODUCTS_URL}/productos", "productos", params={"ids": ids_param(faltantes)},
+                         headers=headers, deadline=deadline)
+    except requests.RequestException as e:
+        log.exception("Error consultando productos: %s", e)
+        return None, ({"error": "Fallo comunicando con servicios internos"}, 502)
+    items = items_revalidados(r.status_code, r.json, vencidos)
+    if items is None:
+        return None, ({"error": "No se pudieron obtener los productos"}, 502)
+    productos.update({int(p["id"]): p for p in items})
+    return productos, None
+
+def armar_detalle(lineas, productos):
+    """Precio por línea a partir de {id: producto}. Devuelve (detalle, total, None) o (None, None, error)."""
+    detalle = []
+    total = 0.0
+    for producto_id, cantidad in lineas:
+        prod = productos.get(producto_id)
+        if prod is None:
+            return None, None, ({"error": f"Producto {producto_id} no encontrado"}, 400)
         precio_unit = float(prod.get("precio", 0))
         if precio_unit <= 0:
-            return {"error": f"Precio inválido para producto {producto_id}"}, 400
+            return None, None, ({"error": f"Precio inválido para producto {producto_id}"}, 400)
 
         total += precio_unit * cantidad
         detalle.append({"producto_id": producto_id, "cantidad": cantidad, "precio_unit": precio_unit})
+    return detalle, total, None
+
+def body_reserva(lineas):
+    return {"items": [{"producto_id": pid, "cantidad": cantidad} for pid, cantidad in lineas]}
+
+def body_pago(pago, total):
+    medio = pago.get("medio", "tarjeta")
+    moneda = pago.get("moneda", "PYG")
+    referencia = pago.get("referencia")
+    pay_body = {"monto": total, "moneda": moneda, "medio": medio}
+    if referencia:
+        pay_body["referencia"] = referencia
+    if pago.get("fail"):
+        pay_body["fail"] = True   # pagos simula el rechazo (pruebas y bench)
+    return pay_body
+
+def guardar_pedido(total, estado, detalle, trabajo=None):
+    """Inserta pedido + items; con trabajo, encola su liquidación en la misma transacción."""
+    if PEDIDOS_AGRUPADOS:
+        pedido_id = escritor.ejecutar(insertar_pedido, total, estado, detalle, trabajo)
+    else:
+        with get_db() as con:
+            pedido_id = insertar_pedido(con.cursor(), total, estado, detalle, trabajo)
+            con.commit()
+    anotar(pedido_id=pedido_id)
+    return pedido_id
+
+def insertar_pedido(c, total, estado, detalle, trabajo=None):
+    c.execute("INSERT INTO pedidos (total, estado, created_at) VALUES (?,?,?)",
+              (total, estado, datetime.datetime.utcnow().isoformat()))
+    pedido_id = c.lastrowid
+    c.executemany("INSERT INTO items (pedido_id, producto_id, cantidad, precio_unit) VALUES (?,?,?,?)",
+                  [(pedido_id, d["producto_id"], d["cantidad"], d["precio_unit"]) for d in detalle])
+    if trabajo is not None:
+        cola.encolar(c, pedido_id, {**trabajo, "pedido_id": pedido_id})
+    if estado == "confirmado":
+        ventas.sumar(c, pedido_id)
+    return pedido_id
+
+def pago_diferido(prefer_header):
+    return PAGO_ASYNC or "respond-async" in (prefer_header or "")
+
+def aceptar_pedido(total, detalle, reservas, pay_body, clave_pago=None, pago_estado=None):
+    """
+    Modo diferido: el pedido queda 'pendiente' y la cola lo liquida. Devuelve (body, 202, headers).
+    clave_pago: la Idempotency-Key de un pago ya intentado con resultado incierto; la cola la
+    repite y obtiene ese mismo resultado en vez de cobrar de nuevo.
+    pago_estado: el pago ya se resolvió y sólo falta consumir/liberar las reservas.
+    """
+    trabajo = {"reservas": reservas, "pago": pay_body, "traceparent": traceparent_actual()}
+    if clave_pago:
+        trabajo["clave_pago"] = clave_pago
+    if pago_estado:
+        trabajo["pago_estado"] = pago_estado
+    pedido_id = guardar_pedido(total, "pendiente", detalle, trabajo)
+    cola.ensure_workers()
+    return ({"pedido_id": pedido_id, "total": total, "estado": "pendiente"}, 202,
+            {"Location": f"/pedidos/{pedido_id}/estado"})
+
+def cerrar_pedido(pedido_id, estado):
+    with get_db() as con:
+        cur = con.execute("UPDATE pedidos SET estado=?, version=version+1 WHERE id=? AND estado='pendiente'",
+                          (estado, pedido_id))
+        if cur.rowcount and estado == "confirmado":
+            ventas.sumar(con.cursor(), pedido_id)
+
+def liquidar_pedido(trabajo, guardar):
+    """
+    Paso de la cola: pago y después consumir o liberar. Idempotente por pasos:
+    el resultado del pago se guarda antes de tocar inventario, y consumir/liberar
+    sobre reservas ya cerradas no hace nada.
+    """
+    pedido_id = trabajo["pedido_id"]
+    if "pago_estado" not in trabajo:
+        # Sin reintentos locales: los maneja la cola (el breaker sí aplica). Una clave en curso
+        # en pagos lanza EnCurso y el trabajo se reintenta, nunca se toma como rechazo
+        clave = trabajo.get("clave_pago") or f"pedido-{pedido_id}-pago"
+        r = request_json("POST", f"{PAYMENTS_URL}/pagar", "pagos", json=trabajo["pago"], retries=0,
+                         headers={"Idempotency-Key": clave})
+        aprobado = r.status_code == 200 and r.json().get("estado") == "aprobado"
+        trabajo["pago_estado"] = "aprobado" if aprobado else "rechazado"
+        guardar(trabajo)
+
+    paso = "consumir" if trabajo["pago_estado"] == "aprobado" else "liberar"
+    r = request_json("POST", f"{INVENTORY_URL}/{paso}/lote", "inventario",
+                     json={"reserva_ids": trabajo["reservas"]}, retries=0)
+    r.raise_for_status()
+    if paso == "consumir" and r.json().get("liberadas"):
+        # El pago pasó pero alguna reserva venció (RESERVA_TTL de inventario) y su stock ya se devolvió
+        log.error("Pedido %s: reservas vencidas antes de consumir %s", pedido_id, r.json()["liberadas"])
+        cerrar_pedido(pedido_id, "error")
+        return
+    cerrar_pedido(pedido_id, "confirmado" if paso == "consumir" else "cancelado")
+
+def liquidacion_agotada(trabajo, error):
+    # Las reservas quedan activas: si el pago pudo haber pasado no se devuelve el stock a ciegas
+    cerrar_pedido(trabajo["pedido_id"], "error")
+
+cola = ColaTrabajos(db, liquidar_pedido, al_agotar=liquidacion_agotada,
+                    workers=LIQUIDACION_WORKERS, max_intentos=LIQUIDACION_MAX_INTENTOS)
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "service": "pedidos"}
+
+def clave_saga(idempotency_key):
+    """Base de las claves que la saga manda a inventario/pagos: la del pedido, o una por ejecución."""
+    return idempotency_key or f"pedido-{uuid.uuid4().hex}"
+
+@app.post("/pedidos")
+@require_token
+@idempotente
+def crear_pedido():
+    data = request.get_json(silent=True) or {}
+    pago = data.get("pago") or {}
+
+    lineas, err = parse_lineas(data.get("items") or [])
+    if err:
+        return err
+
+    deadline = time.monotonic() + PEDIDO_TIMEOUT
+    clave = clave_saga(request.headers.get("Idempotency-Key"))
+
+    productos, err = obtener_productos(lineas, deadline)
+    if err:
+        return err
+
+    detalle, total, err = armar_detalle(lineas, productos)
+    if err:
+        return err
 
     reservas = []
     try:
-        for d in detalle:
-            r = requests.post(f"{INVENTORY_URL}/reservar", headers=auth_headers(),
-                              json={"producto_id": d["producto_id"], "cantidad": d["cantidad"]}, timeout=5)
-            if r.status_code != 200:
-                for rr in reservas:
-                    try:
-                        requests.post(f"{INVENTORY_URL}/liberar", headers=auth_headers(), json={"reserva_id": rr}, timeout=5)
-                    except Exception:
-                        log.exception("Error liberando reserva %s", rr)
-                return {"error": "No se pudo reservar", "detalle": r.json()}, 409
-            reservas.append(r.json()["reserva_id"])
-
-        medio = pago.get("medio", "tarjeta")
-        moneda = pago.get("moneda", "PYG")
-        referencia = pago.get("referencia")
-        pay_body = {"monto": total, "moneda": moneda, "medio": medio}
-        if referencia:
-            pay_body["referencia"] = referencia
-        pay_resp = requests.post(f"{PAYMENTS_URL}/pagar", headers=auth_headers(), json=pay_body, timeout=5)
+        # Todas las líneas se reservan en una sola transacción (todo o nada)
+        r = request_json("POST", f"{INVENTORY_URL}/reservas/lote", "inventario", json=body_reserva(lineas),
+                         headers={"Idempotency-Key": f"{clave}-reserva"}, deadline=deadline)
+        if r.status_code != 200:
+            return {"error": "No se pudo reservar", "detalle": r.json()}, 409
+        reservas = [x["reserva_id"] for x in r.json()["reservas"]]
+
+        if pago_diferido(request.headers.get("Prefer")):
+            return aceptar_pedido(total, detalle, reservas, body_pago(pago, total))
+
+        pay_body, clave_pago = body_pago(pago, total), f"{clave}-pago"
+        try:
+            pay_resp = request_json("POST", f"{PAYMENTS_URL}/pagar", "pagos", json=pay_body,
+                                    headers={"Idempotency-Key": clave_pago}, deadline=deadline)
+        except requests.RequestException as e:
+            if not http_client.resultado_incierto(e):
+                raise
+            # El pago pudo haberse registrado: no se compensa; la cola lo resuelve con la misma clave
+            log.warning("Resultado del pago incierto (%s): el pedido pasa a liquidación diferida", e)
+            return aceptar_pedido(total, detalle, reservas, pay_body, clave_pago)
         if pay_resp.status_code != 200 or pay_resp.json().get("estado") != "aprobado":
-            for rr in reservas:
-                try:
-                    requests.post(f"{INVENTORY_URL}/liberar", headers=auth_headers(), json={"reserva_id": rr}, timeout=5)
-                except Exception:
-                    log.exception("Error liberando reserva %s", rr)
+            liberar_reservas(reservas)
             estado = "cancelado"
         else:
-            for rr in reservas:
-                requests.post(f"{INVENTORY_URL}/consumir", headers=auth_headers(), json={"reserva_id": rr}, timeout=5)
+            # Ya cobrado: consumir respeta el deadline y, si no llega (o falla), lo termina la cola
+            try:
+                request_json("POST", f"{INVENTORY_URL}/consumir/lote", "inventario",
+                             json={"reserva_ids": reservas}, idempotent=True, deadline=deadline)
+            except requests.RequestException as e:
+                log.warning("Pago aprobado pero consumir falló (%s): el pedido pasa a liquidación diferida", e)
+                return aceptar_pedido(total, detalle, reservas, pay_body, clave_pago, "aprobado")
             estado = "confirmado"
 
-        with get_db() as con:
-            c = con.cursor()
-            c.execute("INSERT INTO pedidos (total, estado, created_at) VALUES (?,?,?)",
-                      (total, estado, datetime.datetime.utcnow().isoformat()))
-            pedido_id = c.lastrowid
-            for d in detalle:
-                c.execute("INSERT INTO items (pedido_id, producto_id, cantidad, precio_unit) VALUES (?,?,?,?)",
-                          (pedido_id, d["producto_id"], d["cantidad"], d["precio_unit"]))
-            con.commit()
-
+        pedido_id = guardar_pedido(total, estado, detalle)
         code = 201 if estado == "confirmado" else 202
         return {"pedido_id": pedido_id, "total": total, "estado": estado}, code
 
     except requests.RequestException as e:
         log.exception("Error en comunicación interna: %s", e)
-        for rr in reservas:
-            try:
-                requests.post(f"{INVENTORY_URL}/liberar", headers=auth_headers(), json={"reserva_id": rr}, timeout=5)
-            except Exception:
-                log.exception("Error liberando reserva %s", rr)
+        liberar_reservas(reservas)
         return {"error": "Fallo comunicando con servicios internos"}, 502
 
+@app.get("/pedidos")
+@require_token
+def listar_pedidos():
+    """
+    Historial, del más nuevo al más viejo: ?estado=&desde=&hasta= (fechas ISO, hasta inclusive),
+    paginado por keyset con ?before_id=<último id recibido>&limit=. Los items de la página salen en una consulta.
+    """
+    try:
+        where, params = filtros_pedidos(request.args)
+        before_id = request.args.get("before_id")
+        if before_id is not None:
+            where.append("id < ?")
+            params.append(int(before_id))
+        limit = min(int(request.args.get("limit", PAGE_SIZE)), PAGE_SIZE_MAX)
+    except ValueError:
+        return {"error": "Parámetros inválidos"}, 400
+    if limit <= 0:
+        return {"error": "limit debe ser positivo"}, 400
+    sql = "SELECT id, total, estado, created_at FROM pedidos"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    with get_db() as con:
+        rows = con.execute(sql + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+        pedidos = [dict(r, items=[]) for r in rows]
+        if pedidos:
+            por_id = {p["id"]: p for p in pedidos}
+            marks = ",".join("?" * len(por_id))
+            for it in con.execute(f"SELECT pedido_id, producto_id, cantidad, precio_unit FROM items "
+                                  f"WHERE pedido_id IN ({marks}) ORDER BY id", list(por_id)):
+                por_id[it["pedido_id"]]["items"].append(
+                    {"producto_id": it["producto_id"], "cantidad": it["cantidad"], "precio_unit": it["precio_unit"]})
+    next_before_id = pedidos[-1]["id"] if len(pedidos) == limit else None
+    return {"pedidos": pedidos, "next_before_id": next_before_id}
+
+def filtros_pedidos(args):
+    """?estado=&desde=&hasta= -> (condiciones, parámetros). hasta con sólo fecha incluye todo ese día."""
+    where, params = [], []
+    if args.get("estado"):
+        where.append("estado = ?")
+        params.append(args["estado"])
+    if args.get("desde"):
+        where.append("created_at >= ?")
+        params.append(datetime.datetime.fromisoformat(args["desde"]).isoformat())
+    if args.get("hasta"):
+        hasta = args["hasta"]
+        if len(hasta) == 10:
+            where.append("created_at < ?")
+            params.append((datetime.date.fromisoformat(hasta) + datetime.timedelta(days=1)).isoformat())
+        else:
+            where.append("created_at <= ?")
+            params.append(datetime.datetime.fromisoformat(hasta).isoformat())
+    return where, params
+
+@app.get("/reportes/ventas-diarias")
+@require_token
+def reporte_ventas_diarias():
+    """Pedidos confirmados, unidades e ingresos por día: ?desde=&hasta= (YYYY-MM-DD, inclusive)."""
+    try:
+        desde, hasta = (request.args.get(k) for k in ("desde", "hasta"))
+        for f in (desde, hasta):
+            if f:
+                datetime.date.fromisoformat(f)
+    except ValueError:
+        return {"error": "Fechas inválidas (YYYY-MM-DD)"}, 400
+    with get_db() as con:
+        return {"dias": ventas.por_dia(con, desde, hasta)}
+
+@app.get("/reportes/productos")
+@require_token
+def reporte_productos():
+    """Productos más vendidos: ?orden=unidades|ingresos&limit=."""
+    try:
+        limit = min(int(request.args.get("limit", 100)), PAGE_SIZE_MAX)
+    except ValueError:
+        return {"error": "Parámetros inválidos"}, 400
+    with get_db() as con:
+        return {"productos": ventas.por_producto(con, request.args.get("orden", "unidades"), limit)}
+
 @app.get("/pedidos/<int:pid>")
 @require_token
 def detalle_pedido(pid: int):
     with get_db() as con:
         c = con.cursor()
-        p = c.execute("SELECT id, total, estado, created_at FROM pedidos WHERE id=?", (pid,)).fetchone()
+        p = c.execute("SELECT id, total, estado, created_at, version FROM pedidos WHERE id=?", (pid,)).fetchone()
         if not p:
             return {"error": "No encontrado"}, 404
+        tag = etag("o", p["id"], p["version"], medio=medio_respuesta())
+        if coincide(request.headers.get("If-None-Match"), tag):
+            return "", 304, {"ETag": tag, "Vary": "Accept"}
         its = c.execute("SELECT producto_id, cantidad, precio_unit FROM items WHERE pedido_id=?", (pid,)).fetchall()
-    return {"pedido": dict(p), "items": [dict(x) for x in its]}
+    pedido = {k: p[k] for k in ("id", "total", "estado", "created_at")}
+    return {"pedido": pedido, "items": [dict(x) for x in its]}, 200, {"ETag": tag}
 
-if __name__ == "__main__":
+@app.get("/resiliencia")
+@require_token
+def resiliencia():
+    """Breakers y reintentos por servicio destino."""
+    return http_client.snapshot()
+
+@app.get("/pedidos/<int:pid>/estado")
+@require_token
+def estado_pedido(pid: int):
+    with get_db() as con:
+        p = con.execute("SELECT id, estado FROM pedidos WHERE id=?", (pid,)).fetchone()
+    if not p:
+        return {"error": "No encontrado"}, 404
+    return {"pedido_id": p["id"], "estado": p["estado"], "liquidacion": cola.estado(pid)}
+
+def create_app():
+    """Fábrica para servidores WSGI (serve.py): esquema y workers de liquidación, una vez por proceso."""
     init_db()
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    cola.ensure_workers()
+    return app
+
+if __name__ == "__main__":
+    create_app().run(host="0.0.0.0", port=PORT, debug=True)
@@ -0,0 +1,109 @@
+"""
+Entrada ASGI de pedidos.
+POST /pedidos corre sobre la saga async (saga_async); el resto de rutas las
+atiende la app Flask de siempre a través de WsgiToAsgi.
+
+    uvicorn asgi:application --port 5004
+"""
+import os
+import asyncio
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as pedidos
+import saga_async
+from common import formato, tracing
+
+flask_app = WsgiToAsgi(pedidos.app)
+
+async def _leer_body(receive) -> bytes:
+    chunks = []
+    more = True
+    while more:
+        msg = await receive()
+        chunks.append(msg.get("body", b""))
+        more = msg.get("more_body", False)
+    return b"".join(chunks)
+
+def _medio(headers) -> str:
+    """Formato de la respuesta según el Accept, como negociar_formato en la app Flask."""
+    return formato.MSGPACK if formato.acepta_msgpack(headers.get(b"accept", b"").decode("latin-1")) else formato.JSON
+
+async def _responder(send, body, code, headers=None, tipo=formato.JSON):
+    await _responder_raw(send, formato.codificar(body, tipo), code, headers, tipo)
+
+async def _responder_raw(send, raw, code, headers=None, tipo=formato.JSON):
+    extra = [(k.lower().encode("latin-1"), str(v).encode("latin-1"))
+             for k, v in (headers or {}).items() if k.lower() not in ("content-type", "vary")]
+    sp = tracing.actual()
+    if sp is not None:
+        sp.status = code
+        extra.append((b"x-trace-id", sp.trace_id.encode("latin-1")))
+    await send({
+        "type": "http.response.start",
+        "status": code,
+        "headers": [(b"content-type", tipo.encode("latin-1")), (b"content-length", str(len(raw)).encode()),
+                    (b"vary", b"Accept")] + extra,
+    })
+    await send({"type": "http.response.body", "body": raw})
+
+async def _lifespan(receive, send):
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            # serve.py ya lo hizo antes de lanzar los workers (ESQUEMA_LISTO): no compiten por migrar
+            if os.getenv("ESQUEMA_LISTO") != "1":
+                pedidos.init_db()
+            pedidos.cola.ensure_workers()
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            await saga_async.cerrar_cliente()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def _crear_pedido(headers, receive, send):
+    tipo = _medio(headers)
+    if headers.get(b"authorization", b"").decode("latin-1") != f"Bearer {pedidos.TOKEN}":
+        return await _responder(send, {"error": "No autorizado"}, 401, tipo=tipo)
+    raw = await _leer_body(receive)
+    try:
+        data = formato.decodificar(raw, headers.get(b"content-type", b"").decode("latin-1")) if raw else {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    diferido = pedidos.pago_diferido(headers.get(b"prefer", b"").decode("latin-1"))
+    clave = headers.get(b"idempotency-key", b"").decode("latin-1") or None
+    if clave is None:
+        body, code, *extra = await saga_async.crear_pedido(data, diferido)
+        return await _responder(send, body, code, extra[0] if extra else None, tipo)
+
+    previa = await asyncio.to_thread(pedidos.idempotente.tomar, clave, pedidos.idempotente.huella(raw))
+    if previa is not None:
+        # Guardada como JSON: sale en el formato que pide el Accept de esta repetición
+        status, body, extra = previa
+        body = bytes(body)
+        if body and tipo == formato.MSGPACK:
+            body = formato.codificar(formato.loads_json(body), tipo)
+        return await _responder_raw(send, body, status, extra, tipo)
+    try:
+        body, code, *extra = await saga_async.crear_pedido(data, diferido, clave)
+    except Exception as e:
+        await asyncio.to_thread(pedidos.idempotente.fallo, clave, e)
+        raise
+    extra = extra[0] if extra else {}
+    await asyncio.to_thread(pedidos.idempotente.guardar_o_retener, clave, code, formato.dumps_json(body),
+                            {**extra, "Content-Type": formato.JSON})
+    return await _responder(send, body, code, extra, tipo)
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"].rstrip("/") == "/pedidos":
+        headers = dict(scope["headers"])
+        with tracing.span("POST /pedidos", "server", headers.get(b"traceparent", b"").decode("latin-1"),
+                          "pedidos"):
+            return await _crear_pedido(headers, receive, send)
+
+    return await flask_app(scope, receive, send)
@@ -0,0 +1,140 @@
+import json
+import time
+import logging
+import random
+import datetime
+import threading
+
+from common import tracing
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS trabajos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pedido_id INTEGER NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        estado TEXT NOT NULL CHECK (estado IN ('pendiente','en_curso','hecho','error')),
+        intentos INTEGER NOT NULL DEFAULT 0,
+        proximo_intento REAL NOT NULL,
+        lease_until REAL,
+        ultimo_error TEXT,
+        created_at TEXT NOT NULL
+    )
+"""
+
+class ColaTrabajos:
+    """
+    Cola durable en SQLite (tabla trabajos de pedidos.db) atendida por un pool de hilos.
+    - Tomar un trabajo es un UPDATE ... RETURNING bajo BEGIN IMMEDIATE: dos hilos (o dos
+      procesos) nunca toman el mismo.
+    - Un trabajo 'en_curso' cuyo lease venció (worker caído) vuelve a tomarse.
+    - Si handler lanza, se reintenta con backoff exponencial hasta max_intentos;
+      después se llama a al_agotar(payload, error) y el trabajo queda en 'error'.
+    handler(payload, guardar) debe ser idempotente; guardar(payload) persiste el avance
+    entre pasos para no repetirlos en el reintento.
+    """
+
+    def __init__(self, db, handler, al_agotar=None, workers=2, max_intentos=5,
+                 poll=0.2, lease=60.0, backoff=0.5):
+        self.db = db
+        self.handler = handler
+        self.al_agotar = al_agotar
+        self.workers = workers
+        self.max_intentos = max_intentos
+        self.poll = poll
+        self.lease = lease
+        self.backoff = backoff
+        self._hilos = []
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+
+    @staticmethod
+    def init_db(con):
+        con.execute(SCHEMA)
+        con.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos (estado, proximo_intento)")
+
+    def encolar(self, c, pedido_id, payload):
+        """Inserta el trabajo con el cursor c (misma transacción que el pedido)."""
+        c.execute("INSERT INTO trabajos (pedido_id, payload, estado, proximo_intento, created_at) "
+                  "VALUES (?,?, 'pendiente', ?, ?)",
+                  (pedido_id, json.dumps(payload), time.time(), datetime.datetime.utcnow().isoformat()))
+        self._despertar.set()
+
+    def estado(self, pedido_id):
+        con = self.db.connection()
+        row = con.execute("SELECT estado, intentos, ultimo_error FROM trabajos WHERE pedido_id=?",
+                          (pedido_id,)).fetchone()
+        return dict(row) if row else None
+
+    def ensure_workers(self):
+        with self._lock:
+            self._hilos = [h for h in self._hilos if h.is_alive()]
+            while len(self._hilos) < self.workers:
+                h = threading.Thread(target=self._loop, name=f"liquidacion-{len(self._hilos)}", daemon=True)
+                h.start()
+                self._hilos.append(h)
+
+    # --- internos ---
+
+    def _tomar(self):
+        con = self.db.connection()
+        ahora = time.time()
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            row = con.execute(
+                """UPDATE trabajos SET estado='en_curso', intentos=intentos+1, lease_until=?
+                   WHERE id = (SELECT id FROM trabajos
+                               WHERE (estado='pendiente' AND proximo_intento <= ?)
+                                  OR (estado='en_curso' AND lease_until < ?)
+                               ORDER BY id LIMIT 1)
+                   RETURNING id, pedido_id, payload, intentos""",
+                (ahora + self.lease, ahora, ahora)).fetchone()
+        return dict(row) if row else None
+
+    def _guardar(self, job_id, payload):
+        con = self.db.connection()
+        with con:
+            con.execute("UPDATE trabajos SET payload=? WHERE id=?", (json.dumps(payload), job_id))
+
+    def _terminar(self, job_id, estado, error=None, proximo=None):
+        con = self.db.connection()
+        with con:
+            con.execute("UPDATE trabajos SET estado=?, ultimo_error=?, proximo_intento=COALESCE(?, proximo_intento), "
+                        "lease_until=NULL WHERE id=?", (estado, error, proximo, job_id))
+
+    def _loop(self):
+        while True:
+            try:
+                job = self._tomar()
+            except Exception:
+                log.exception("[cola] error tomando trabajo")
+                job = None
+            if job is None:
+                self._despertar.wait(self.poll)
+                self._despertar.clear()
+                continue
+            self._ejecutar(job)
+
+    def _ejecutar(self, job):
+        payload = json.loads(job["payload"])
+        try:
+            # Continúa la traza del request que encoló el trabajo (si la trajo)
+            with tracing.span("trabajo", "consumer", payload.get("traceparent"),
+                              pedido_id=job["pedido_id"], intento=job["intentos"]):
+                self.handler(payload, lambda p: self._guardar(job["id"], p))
+            self._terminar(job["id"], "hecho")
+        except Exception as e:
+            err = f"{type(e).__name__}: {e}"
+            if job["intentos"] >= self.max_intentos:
+                log.error("[cola] pedido %s agotó %s intentos: %s", job["pedido_id"], job["intentos"], err)
+                self._terminar(job["id"], "error", err)
+                if self.al_agotar:
+                    try:
+                        self.al_agotar(payload, err)
+                    except Exception:
+                        log.exception("[cola] error en al_agotar del pedido %s", job["pedido_id"])
+            else:
+                delay = self.backoff * (2 ** (job["intentos"] - 1)) * (0.5 + random.random())
+                log.warning("[cola] pedido %s falló (%s), reintento en %.1fs", job["pedido_id"], err, delay)
+                self._terminar(job["id"], "pendiente", err, time.time() + delay)
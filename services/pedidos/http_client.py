@@ -1,82 +1,353 @@
 import time
+import random
 import logging
+import threading
 import requests
 import os
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from common import tracing, formato
+from common.metrics import DEPENDENCY_SECONDS
 
 log = logging.getLogger(__name__)
 
-TOKEN = os.getenv("SERVICE_TOKEN")
+TOKEN = os.getenv("SERVICE_TOKEN", "penguin-secret")
 
-# Estado de circuit breaker por servicio
-CB = {}                # svc -> {failures:int, opened_until:float}
-THRESHOLD = 3          # fallos consecutivos para abrir
-OPEN_SECONDS = 30      # ventana en estado OPEN
+# Pool de conexiones keep-alive por servicio destino
+POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))   # hosts distintos cacheados por sesión
+POOL_MAXSIZE     = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))      # conexiones reutilizables por host
+POOL_BLOCK       = os.getenv("HTTP_POOL_BLOCK", "0") == "1"       # esperar conexión libre en vez de abrir otra
 
-def state_for(svc: str) -> dict:
-    d = CB.get(svc)
-    if d is None:
-        d = {"failures": 0, "opened_until": 0.0}
-        CB[svc] = d
-    return d
+_sessions = {}         # svc -> requests.Session
+_sessions_lock = threading.Lock()
 
-def is_open(svc: str) -> bool:
-    s = state_for(svc)
-    return time.time() < s["opened_until"]
+def session_for(svc: str) -> requests.Session:
+    """Devuelve la sesión compartida (thread-safe) para el servicio lógico svc."""
+    s = _sessions.get(svc)
+    if s is not None:
+        return s
+    with _sessions_lock:
+        s = _sessions.get(svc)
+        if s is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                                  pool_block=POOL_BLOCK)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _sessions[svc] = s
+    return s
+
+# Circuit breaker por servicio
+THRESHOLD      = int(os.getenv("CB_THRESHOLD", "3"))          # fallos consecutivos para abrir
+OPEN_SECONDS   = float(os.getenv("CB_OPEN_SECONDS", "30"))    # ventana en estado OPEN
+HALF_OPEN_MAX  = int(os.getenv("CB_HALF_OPEN_MAX", "1"))      # requests de prueba simultáneos en HALF_OPEN
+
+# Reintentos: backoff exponencial con jitter, acotado por presupuesto y deadline
+BACKOFF_BASE   = float(os.getenv("RETRY_BACKOFF_BASE", "0.1"))
+BACKOFF_CAP    = float(os.getenv("RETRY_BACKOFF_CAP", "2.0"))
+RETRY_RATIO    = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))   # reintentos por request "ganados"
+RETRY_MIN      = float(os.getenv("RETRY_BUDGET_MIN", "10"))      # saldo inicial / tope del presupuesto
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+ACCEPT = {formato.MSGPACK: f"{formato.MSGPACK}, {formato.JSON};q=0.5", formato.JSON: formato.JSON}
+
+# Modo monolito: servicios atendidos en este mismo proceso, sin HTTP (ver services/monolito.py)
+LOCALES = {}           # svc -> handler(method, path, json=, params=, headers=) -> RespuestaLocal
+
+class ServicioNoDisponible(requests.RequestException):
+    """Circuito abierto, o 5xx tras agotar reintentos."""
+
+class FalloServidor(ServicioNoDisponible):
+    """5xx del destino: el request llegó y pudo haber escrito antes de fallar (p.ej. COMMIT hecho y timeout después)."""
+
+class EnCurso(requests.RequestException):
+    """
+    409 con Retry-After: el destino sigue ejecutando un request con la misma Idempotency-Key.
+    El resultado todavía no se conoce (no es un rechazo): no hay que compensar por él.
+    """
+
+    @property
+    def retry_after(self) -> float:
+        try:
+            return float(self.response.headers.get("Retry-After", 1))
+        except (AttributeError, ValueError):
+            return 1.0
+
+def resultado_incierto(e: Exception) -> bool:
+    """True si el destino pudo haber ejecutado el request: timeout de lectura, conexión cortada, 5xx o clave en curso."""
+    if isinstance(e, (EnCurso, FalloServidor)):
+        return True
+    if isinstance(e, requests.ConnectTimeout) or not isinstance(e, (requests.Timeout, requests.ConnectionError)):
+        return False
+    # Conexión rechazada: el request nunca salió
+    motivo = getattr(e.args[0], "reason", None) if e.args else None
+    return not isinstance(motivo, NewConnectionError)
+
+def _peor(e: Exception, incierto: Exception | None) -> Exception:
+    """Error a lanzar al rendirse: si un intento anterior quedó incierto, un fallo definitivo posterior no lo borra."""
+    if incierto is not None and not resultado_incierto(e):
+        return incierto
+    return e
+
+def en_curso(resp) -> bool:
+    return resp.status_code == 409 and "Retry-After" in resp.headers
+
+class RespuestaHTTP(requests.Response):
+    """requests.Response cuyo .json() también decodifica MessagePack (y JSON con orjson)."""
+
+    def json(self, **kwargs):
+        return formato.decodificar(self.content, self.headers.get("Content-Type"))
+
+class RespuestaLocal:
+    """Lo que pedidos usa de requests.Response, para respuestas de un servicio en proceso."""
+
+    def __init__(self, status_code: int, body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._body = body
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def json(self):
+        return self._body
 
-def open_circuit(svc: str) -> None:
-    s = state_for(svc)
-    s["opened_until"] = time.time() + OPEN_SECONDS
-    log.warning("[CB] %s OPEN por %ss", svc, OPEN_SECONDS)
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code} (local)", response=self)
+
+def registrar_local(svc: str, handler) -> None:
+    LOCALES[svc] = handler
+
+class CircuitBreaker:
+    """CLOSED -> (THRESHOLD fallos) -> OPEN -> (OPEN_SECONDS) -> HALF_OPEN -> éxito: CLOSED / fallo: OPEN."""
+
+    def __init__(self, svc: str):
+        self.svc = svc
+        self.state = "closed"
+        self.failures = 0
+        self.opened_until = 0.0
+        self.trials = 0           # requests de prueba en vuelo durante HALF_OPEN
+        self.trials_until = 0.0   # pasado esto, las pruebas que no informaron se dan por perdidas
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            ahora = time.monotonic()
+            if self.state == "open":
+                if ahora < self.opened_until:
+                    return False
+                self.state = "half_open"
+                self.trials = 0
+                log.info("[CB] %s HALF_OPEN", self.svc)
+            if self.state == "half_open":
+                if self.trials >= HALF_OPEN_MAX:
+                    # Una prueba cancelada (o que terminó con un error ajeno al breaker) nunca llama
+                    # a success()/failure(): tras OPEN_SECONDS su lugar se libera para otra
+                    if ahora < self.trials_until:
+                        return False
+                    log.warning("[CB] %s pruebas HALF_OPEN sin resultado, se liberan", self.svc)
+                    self.trials = 0
+                self.trials += 1
+                self.trials_until = ahora + OPEN_SECONDS
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            if self.state != "closed":
+                log.info("[CB] %s CLOSED", self.svc)
+            self.state = "closed"
+            self.failures = 0
+            self.trials = 0
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= THRESHOLD:
+                self.state = "open"
+                self.opened_until = time.monotonic() + OPEN_SECONDS
+                self.trials = 0
+                log.warning("[CB] %s OPEN por %ss", self.svc, OPEN_SECONDS)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            restante = max(0.0, self.opened_until - time.monotonic()) if self.state == "open" else 0.0
+            return {"state": self.state, "failures": self.failures, "open_remaining_s": round(restante, 2)}
+
+class RetryBudget:
+    """Cada request suma RETRY_RATIO, cada reintento gasta 1: los reintentos no multiplican la carga."""
+
+    def __init__(self):
+        self.balance = RETRY_MIN
+        self.requests = 0
+        self.retries = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.balance = min(RETRY_MIN, self.balance + RETRY_RATIO)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.balance < 1:
+                self.denied += 1
+                return False
+            self.balance -= 1
+            self.retries += 1
+            return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "retries": self.retries, "retries_denied": self.denied,
+                    "balance": round(self.balance, 2)}
+
+CB = {}                # svc -> CircuitBreaker
+BUDGETS = {}           # svc -> RetryBudget
+_state_lock = threading.Lock()
+
+def breaker(svc: str) -> CircuitBreaker:
+    b = CB.get(svc)
+    if b is None:
+        with _state_lock:
+            b = CB.setdefault(svc, CircuitBreaker(svc))
+    return b
+
+def budget(svc: str) -> RetryBudget:
+    b = BUDGETS.get(svc)
+    if b is None:
+        with _state_lock:
+            b = BUDGETS.setdefault(svc, RetryBudget())
+    return b
+
+def is_open(svc: str) -> bool:
+    return breaker(svc).snapshot()["state"] == "open"
 
 def record_success(svc: str) -> None:
-    s = state_for(svc)
-    s["failures"] = 0
-    s["opened_until"] = 0.0
+    breaker(svc).success()
 
 def record_failure(svc: str) -> None:
-    s = state_for(svc)
-    s["failures"] += 1
-    if s["failures"] >= THRESHOLD:
-        open_circuit(svc)
+    breaker(svc).failure()
+
+def snapshot() -> dict:
+    """Estado de breakers y presupuestos de reintento, para monitoreo."""
+    svcs = sorted(set(CB) | set(BUDGETS))
+    return {svc: {"breaker": breaker(svc).snapshot(), "retry": budget(svc).snapshot()} for svc in svcs}
+
+def backoff(attempt: int) -> float:
+    """Full jitter: uniforme en [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
 
 def request_json(method: str, url: str, svc: str, json=None, timeout: float = 5.0,
-                 retries: int = 2, token: str | None = None):
+                 retries: int = 2, token: str | None = None, params=None, headers=None,
+                 deadline: float | None = None, idempotent: bool | None = None):
     """
-    Llamada HTTP con circuit breaker simple por servicio.
+    Llamada HTTP con circuit breaker por servicio y reintentos.
     - svc: nombre lógico del servicio destino ("productos", "inventario", "pagos"...)
-    - retries: reintentos (además del intento inicial)
-    - Si el circuito está OPEN, lanza RuntimeError
+    - retries: reintentos (además del intento inicial), si el presupuesto del servicio alcanza
+    - deadline: instante (time.monotonic) que ningún intento ni espera puede pasar
+    - idempotent: si se puede repetir tras un error ambiguo; por defecto, según el método
+      o si lleva Idempotency-Key. Los timeouts de conexión se reintentan siempre.
+    - Si el circuito está OPEN, lanza ServicioNoDisponible
+    - 409 con Retry-After (Idempotency-Key en curso del otro lado) se reintenta esperando al menos
+      Retry-After; si no se resuelve, lanza EnCurso
     Devuelve 'requests.Response'.
     """
+    local = LOCALES.get(svc)
+    if local is not None:
+        return _llamar_local(local, method, url, svc, json, params, headers)
     if token is None:
         token = TOKEN
-
-    if is_open(svc):
-        raise RuntimeError(f"Circuit breaker OPEN para {svc}")
-
-    headers = {"Authorization": f"Bearer {token}"}
+    # Entre servicios se prefiere el formato binario (WIRE_FORMAT); cada servicio cae a JSON si no lo tiene
+    tipo = formato.tipo_interno()
+    hdrs = {"Authorization": f"Bearer {token}", "Accept": ACCEPT[tipo]}
+    hdrs.update(headers or {})
+    body = None
     if json is not None:
-        headers["Content-Type"] = "application/json"
+        hdrs["Content-Type"] = tipo
+        body = formato.codificar(json, tipo)
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS or "Idempotency-Key" in hdrs
 
-    last_err = None
+    cb = breaker(svc)
+    rb = budget(svc)
+    rb.deposit()
     total_attempts = 1 + max(0, int(retries))
-    for attempt in range(total_attempts):
+    attempt = 0
+    incierto = None       # último intento que pudo haber ejecutado del otro lado
+    while True:
+        if not cb.allow():
+            raise _peor(ServicioNoDisponible(f"Circuit breaker OPEN para {svc}"), incierto)
+        attempt_timeout = timeout
+        if deadline is not None:
+            attempt_timeout = min(timeout, deadline - time.monotonic())
+            if attempt_timeout <= 0:
+                raise _peor(requests.Timeout(f"Deadline vencido llamando a {svc}"), incierto)
+        t0 = time.perf_counter()
         try:
-            resp = requests.request(method, url, headers=headers, json=json, timeout=timeout)
-            # Consideramos 5xx como fallo transitorio
-            if resp.status_code >= 500:
-                raise RuntimeError(f"HTTP {resp.status_code} desde {svc}")
-            record_success(svc)
+            # Un span de cliente por intento; su id viaja como traceparent
+            with tracing.span(f"{method.upper()} {urlsplit(url).path}", "client",
+                              dependency=svc, intento=attempt) as sp:
+                hdrs["traceparent"] = sp.traceparent()
+                resp = session_for(svc).request(method, url, headers=hdrs, data=body, params=params,
+                                                timeout=attempt_timeout)
+                resp.__class__ = RespuestaHTTP
+                sp.status = resp.status_code
+                # Consideramos 5xx como fallo transitorio
+                if resp.status_code >= 500:
+                    DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "5xx")
+                    raise FalloServidor(f"HTTP {resp.status_code} desde {svc}", response=resp)
+                if en_curso(resp):
+                    DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "en_curso")
+                    raise EnCurso(f"Idempotency-Key en curso en {svc}", response=resp)
+            DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "ok")
+            cb.success()
             return resp
-        except Exception as e:
-            last_err = e
-            record_failure(svc)
-            # backoff lineal muy simple: 0.5s, 1.0s, 1.5s...
-            if attempt < total_attempts - 1:
-                delay = 0.5 * (attempt + 1)
-                log.warning("[retry] %s fallo: %s. Reintento en %.1fs", svc, e, delay)
-                time.sleep(delay)
+        except requests.RequestException as e:
+            if isinstance(e, EnCurso):
+                cb.success()      # el servicio respondió; sólo falta que termine el primer request
             else:
-                break
-    # Al salir sin éxito
-    raise last_err
+                if not isinstance(e, ServicioNoDisponible):
+                    DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "error")
+                cb.failure()
+            if resultado_incierto(e):
+                incierto = e
+            retryable = idempotent or isinstance(e, (requests.ConnectTimeout, EnCurso))
+            attempt += 1
+            if not retryable or attempt >= total_attempts:
+                raise _peor(e, incierto)
+            delay = backoff(attempt - 1)
+            if isinstance(e, EnCurso):
+                delay = max(delay, e.retry_after)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise _peor(e, incierto)
+            if not rb.withdraw():
+                log.warning("[retry] %s sin presupuesto de reintentos", svc)
+                raise _peor(e, incierto)
+            log.warning("[retry] %s fallo: %s. Reintento en %.2fs", svc, e, delay)
+            time.sleep(delay)
+
+def _llamar_local(handler, method, url, svc, json, params, headers):
+    """Llamada en proceso: sin sesión, token, breaker ni reintentos (no hay red que falle)."""
+    path = urlsplit(url).path
+    t0 = time.perf_counter()
+    with tracing.span(f"{method.upper()} {path}", "internal", dependency=svc) as sp:
+        try:
+            resp = handler(method.upper(), path, json=json, params=params or {}, headers=headers or {})
+        except Exception:
+            # Lo mismo que vería pedidos por HTTP (Flask responde 500): la saga compensa o difiere igual
+            log.exception("Error en %s %s (local)", method.upper(), path)
+            resp = RespuestaLocal(500, {"error": "Error interno"})
+        sp.status = resp.status_code
+    if resp.status_code >= 500:
+        DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "5xx")
+        raise FalloServidor(f"HTTP {resp.status_code} desde {svc} (local)", response=resp)
+    DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "local")
+    if en_curso(resp):
+        raise EnCurso(f"Idempotency-Key en curso en {svc}", response=resp)
+    return resp
@@ -0,0 +1,112 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+CACHE_SIZE    = int(os.getenv("PRODUCT_CACHE_SIZE", "5000"))    # 0 desactiva la caché
+CACHE_TTL     = float(os.getenv("PRODUCT_CACHE_TTL", "60"))     # segundos; cota dura de datos viejos
+POLL_SECONDS  = float(os.getenv("PRODUCT_CACHE_POLL", "2"))     # consulta del feed de cambios; 0 = sin poller
+
+class ProductCache:
+    """
+    Caché LRU + TTL de productos (id -> dict) para el camino de pedidos.
+    Un hilo en segundo plano lee GET /productos/cambios y descarta los ids
+    modificados, así un precio editado deja de servirse en ~POLL_SECONDS.
+    Si el feed no responde, el TTL sigue acotando lo viejo. Al vencer, la entrada
+    se revalida con If-None-Match en vez de volver a bajarse.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()      # id -> (expira, producto)
+        self._lock = threading.Lock()
+        self.version = None             # última versión del feed aplicada
+        self._poller = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, ids):
+        """Devuelve ({id: producto} en caché, [ids faltantes])."""
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for pid in ids:
+                entry = self._data.get(pid)
+                if entry is not None and entry[0] > now:
+                    self._data.move_to_end(pid)
+                    found[pid] = entry[1]
+                else:
+                    # Las vencidas se conservan para revalidarlas por ETag (ver stale)
+                    missing.append(pid)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def stale(self, ids):
+        """Entradas vencidas (pero no invalidadas) de ids: {id: producto}."""
+        with self._lock:
+            return {pid: self._data[pid][1] for pid in ids if pid in self._data}
+
+    def put_many(self, productos):
+        if self.maxsize <= 0:
+            return
+        expira = time.monotonic() + self.ttl
+        with self._lock:
+            for p in productos:
+                pid = int(p["id"])
+                self._data[pid] = (expira, p)
+                self._data.move_to_end(pid)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, ids):
+        with self._lock:
+            for pid in ids:
+                self._data.pop(pid, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "version": self.version}
+
+    # --- invalidación por feed de cambios ---
+
+    def apply_changes(self, feed: dict):
+        """Aplica la respuesta de /productos/cambios."""
+        if self.version is None or not feed.get("completo", False):
+            self.clear()
+        else:
+            self.invalidate(feed.get("ids", []))
+        self.version = int(feed.get("version", 0))
+
+    def poll_once(self, fetch):
+        """fetch(desde) -> dict del feed. Errores se loguean y se reintentan en la próxima vuelta."""
+        try:
+            self.apply_changes(fetch(self.version or 0))
+        except Exception as e:
+            log.warning("[cache] no se pudo leer cambios de productos: %s", e)
+
+    def ensure_poller(self, fetch, every: float = POLL_SECONDS):
+        """Arranca (una vez por proceso) el hilo que consulta el feed."""
+        if every <= 0 or self.maxsize <= 0:
+            return
+        if self._poller is not None and self._poller.is_alive():
+            return
+        with self._lock:
+            if self._poller is not None and self._poller.is_alive():
+                return
+
+            def loop():
+                while True:
+                    self.poll_once(fetch)
+                    time.sleep(every)
+
+            self._poller = threading.Thread(target=loop, name="product-cache-poller", daemon=True)
+            self._poller.start()
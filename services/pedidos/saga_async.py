@@ -0,0 +1,198 @@
+import time
+import asyncio
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+
+import app as pedidos
+import http_client
+from http_client import POOL_MAXSIZE
+from common import formato, tracing
+from common.metrics import DEPENDENCY_SECONDS
+
+log = logging.getLogger(__name__)
+
+# Cliente async compartido (keep-alive); se crea dentro del event loop que lo usa
+_client = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        limits = httpx.Limits(max_connections=POOL_MAXSIZE * 4, max_keepalive_connections=POOL_MAXSIZE)
+        # Mismo formato de red que request_json: revalidacion() arma los ETags con tipo_interno()
+        headers = {**pedidos.auth_headers(), "Accept": http_client.ACCEPT[formato.tipo_interno()]}
+        _client = httpx.AsyncClient(headers=headers, timeout=5, limits=limits)
+    return _client
+
+async def cerrar_cliente():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+class RespuestaAsync(httpx.Response):
+    """httpx.Response cuyo .json() también decodifica MessagePack (como http_client.RespuestaHTTP)."""
+
+    def json(self, **kwargs):
+        return formato.decodificar(self.content, self.headers.get("content-type"))
+
+class ServicioNoDisponible(httpx.HTTPError):
+    """Circuito abierto, 5xx o deadline vencido."""
+
+class FalloServidor(ServicioNoDisponible):
+    """5xx del destino: el request llegó y pudo haber escrito antes de fallar."""
+
+class EnCurso(httpx.HTTPError):
+    """409 con Retry-After: la misma Idempotency-Key sigue en curso en el destino (resultado desconocido)."""
+
+def resultado_incierto(e: Exception) -> bool:
+    """True si el destino pudo haber ejecutado el request (ver http_client.resultado_incierto)."""
+    if isinstance(e, (EnCurso, FalloServidor)):
+        return True
+    return isinstance(e, httpx.TransportError) and not isinstance(
+        e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+async def llamar(svc, method, url, deadline=None, **kwargs):
+    """Request por el cliente compartido, pasando por el mismo circuit breaker que la versión sync."""
+    cb = http_client.breaker(svc)
+    if not cb.allow():
+        raise ServicioNoDisponible(f"Circuit breaker OPEN para {svc}")
+    timeout = 5.0
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise ServicioNoDisponible(f"Deadline vencido llamando a {svc}")
+    hdrs = dict(kwargs.pop("headers", None) or {})
+    if "json" in kwargs:
+        tipo = formato.tipo_interno()
+        hdrs["Content-Type"] = tipo
+        kwargs["content"] = formato.codificar(kwargs.pop("json"), tipo)
+    t0 = time.perf_counter()
+    try:
+        with tracing.span(f"{method} {urlsplit(url).path}", "client", dependency=svc) as sp:
+            hdrs["traceparent"] = sp.traceparent()
+            r = await get_client().request(method, url, timeout=timeout, headers=hdrs, **kwargs)
+            r.__class__ = RespuestaAsync
+            sp.status = r.status_code
+    except httpx.HTTPError:
+        DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "error")
+        cb.failure()
+        raise
+    if r.status_code >= 500:
+        DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "5xx")
+        cb.failure()
+        raise FalloServidor(f"HTTP {r.status_code} desde {svc}")
+    cb.success()
+    if http_client.en_curso(r):
+        DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "en_curso")
+        raise EnCurso(f"Idempotency-Key en curso en {svc}")
+    DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, svc, "ok")
+    return r
+
+async def liberar_reservas(reservas):
+    """Compensación: devuelve al stock las reservas del pedido (nunca lanza)."""
+    if not reservas:
+        return
+    try:
+        await llamar("inventario", "POST", f"{pedidos.INVENTORY_URL}/liberar/lote", json={"reserva_ids": reservas})
+    except Exception:
+        log.exception("Error liberando reservas %s", reservas)
+
+async def _buscar_productos(ids, deadline):
+    """Sólo viaja a productos si hay ids fuera de la caché."""
+    if not ids:
+        return None
+    headers, vencidos = pedidos.revalidacion(ids)
+    r = await llamar("productos", "GET", f"{pedidos.PRODUCTS_URL}/productos", deadline,
+                     params={"ids": pedidos.ids_param(ids)}, headers=headers)
+    return r, vencidos
+
+async def crear_pedido(data: dict, diferido: bool = False, idempotency_key: str | None = None):
+    """
+    Misma saga que pedidos.crear_pedido, pero sin bloquear un hilo por pedido.
+    - Precios (los que no están en caché) y reserva no dependen entre sí: se piden
+      en paralelo. Si el precio falla, la reserva ya hecha se compensa con /liberar/lote.
+    - Pago, consumo/liberación y guardado siguen en orden, como en la versión sync.
+    - diferido=True: el pedido queda 'pendiente' y la cola de liquidación hace el resto.
+    Devuelve (body, status_code) o (body, status_code, headers).
+    """
+    pago = data.get("pago") or {}
+    lineas, err = pedidos.parse_lineas(data.get("items") or [])
+    if err:
+        return err
+
+    deadline = time.monotonic() + pedidos.PEDIDO_TIMEOUT
+    clave = pedidos.clave_saga(idempotency_key)
+    pedidos.productos_cache.ensure_poller(pedidos.fetch_cambios)
+    productos, faltantes = pedidos.productos_cache.get_many({pid for pid, _ in lineas})
+    prod_r, res_r = await asyncio.gather(
+        _buscar_productos(faltantes, deadline),
+        llamar("inventario", "POST", f"{pedidos.INVENTORY_URL}/reservas/lote", deadline,
+               json=pedidos.body_reserva(lineas), headers={"Idempotency-Key": f"{clave}-reserva"}),
+        return_exceptions=True,
+    )
+    reservas = []
+    if not isinstance(res_r, BaseException) and res_r.status_code == 200:
+        reservas = [x["reserva_id"] for x in res_r.json()["reservas"]]
+
+    if isinstance(prod_r, BaseException):
+        log.error("Error consultando productos: %s", prod_r)
+        await liberar_reservas(reservas)
+        return {"error": "Fallo comunicando con servicios internos"}, 502
+    if prod_r is not None:
+        r, vencidos = prod_r
+        items = pedidos.items_revalidados(r.status_code, r.json, vencidos)
+        if items is None:
+            await liberar_reservas(reservas)
+            return {"error": "No se pudieron obtener los productos"}, 502
+        productos.update({int(p["id"]): p for p in items})
+
+    detalle, total, err = pedidos.armar_detalle(lineas, productos)
+    if err:
+        await liberar_reservas(reservas)
+        return err
+
+    if isinstance(res_r, BaseException):
+        log.error("Error en comunicación interna: %s", res_r)
+        return {"error": "Fallo comunicando con servicios internos"}, 502
+    if res_r.status_code != 200:
+        return {"error": "No se pudo reservar", "detalle": res_r.json()}, 409
+
+    if diferido:
+        return await asyncio.to_thread(pedidos.aceptar_pedido, total, detalle, reservas,
+                                       pedidos.body_pago(pago, total))
+
+    pay_body, clave_pago = pedidos.body_pago(pago, total), f"{clave}-pago"
+    try:
+        try:
+            pay_resp = await llamar("pagos", "POST", f"{pedidos.PAYMENTS_URL}/pagar", deadline,
+                                    json=pay_body, headers={"Idempotency-Key": clave_pago})
+        except httpx.HTTPError as e:
+            if not resultado_incierto(e):
+                raise
+            # Como en la versión sync: sin compensar, la cola repite el pago con la misma clave
+            log.warning("Resultado del pago incierto (%s): el pedido pasa a liquidación diferida", e)
+            return await asyncio.to_thread(pedidos.aceptar_pedido, total, detalle, reservas, pay_body, clave_pago)
+        if pay_resp.status_code != 200 or pay_resp.json().get("estado") != "aprobado":
+            await liberar_reservas(reservas)
+            estado = "cancelado"
+        else:
+            # Ya cobrado: si consumir no llega antes del deadline (o falla) lo termina la cola, como en la versión sync
+            try:
+                await llamar("inventario", "POST", f"{pedidos.INVENTORY_URL}/consumir/lote", deadline,
+                             json={"reserva_ids": reservas})
+            except httpx.HTTPError as e:
+                log.warning("Pago aprobado pero consumir falló (%s): el pedido pasa a liquidación diferida", e)
+                return await asyncio.to_thread(pedidos.aceptar_pedido, total, detalle, reservas, pay_body,
+                                               clave_pago, "aprobado")
+            estado = "confirmado"
+
+        pedido_id = await asyncio.to_thread(pedidos.guardar_pedido, total, estado, detalle)
+        code = 201 if estado == "confirmado" else 202
+        return {"pedido_id": pedido_id, "total": total, "estado": estado}, code
+
+    except httpx.HTTPError as e:
+        log.exception("Error en comunicación interna: %s", e)
+        await liberar_reservas(reservas)
+        return {"error": "Fallo comunicando con servicios internos"}, 502
@@ -0,0 +1,105 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+# Resúmenes de ventas, mantenidos al confirmar cada pedido (los reportes no recorren items):
+# - ventas_dia:      por día de creación del pedido
+# - ventas_producto: por producto_id
+# Sólo cuentan pedidos 'confirmado'; sumar() corre en la misma transacción que lo confirma.
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS ventas_dia (
+        dia TEXT PRIMARY KEY,
+        pedidos INTEGER NOT NULL,
+        unidades INTEGER NOT NULL,
+        ingresos REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ventas_producto (
+        producto_id INTEGER PRIMARY KEY,
+        pedidos INTEGER NOT NULL,
+        unidades INTEGER NOT NULL,
+        ingresos REAL NOT NULL
+    )
+    """,
+)
+
+# Upserts desde un SELECT: el WHERE es necesario para que SQLite no lea el ON CONFLICT como parte de un JOIN
+SQL_DIA = """
+    INSERT INTO ventas_dia (dia, pedidos, unidades, ingresos)
+    SELECT substr(created_at, 1, 10), 1,
+           (SELECT COALESCE(SUM(cantidad), 0) FROM items WHERE pedido_id = p.id), total
+    FROM pedidos p WHERE id = ? AND estado = 'confirmado'
+    ON CONFLICT(dia) DO UPDATE SET pedidos = pedidos + excluded.pedidos,
+        unidades = unidades + excluded.unidades, ingresos = ingresos + excluded.ingresos
+"""
+
+SQL_PRODUCTO = """
+    INSERT INTO ventas_producto (producto_id, pedidos, unidades, ingresos)
+    SELECT producto_id, 1, SUM(cantidad), SUM(cantidad * precio_unit)
+    FROM items WHERE pedido_id = ? GROUP BY producto_id
+    ON CONFLICT(producto_id) DO UPDATE SET pedidos = pedidos + excluded.pedidos,
+        unidades = unidades + excluded.unidades, ingresos = ingresos + excluded.ingresos
+"""
+
+def init_db(con):
+    # Listado: items de una página en una consulta; filtros por estado y rango de fechas
+    con.execute("CREATE INDEX IF NOT EXISTS idx_items_pedido ON items (pedido_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_estado ON pedidos (estado, id)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_pedidos_created ON pedidos (created_at)")
+    nuevas = con.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' "
+                         "AND name IN ('ventas_dia','ventas_producto')").fetchone()[0] < 2
+    for sql in SCHEMA:
+        con.execute(sql)
+    if nuevas:
+        reconstruir(con)
+
+def sumar(c, pedido_id):
+    """Suma a los resúmenes un pedido recién confirmado (con el cursor de esa transacción)."""
+    if c.execute(SQL_DIA, (pedido_id,)).rowcount:
+        c.execute(SQL_PRODUCTO, (pedido_id,))
+
+def reconstruir(con):
+    """Recalcula los resúmenes desde pedidos/items (DBs previas a las tablas, o tras una corrección a mano)."""
+    con.execute("DELETE FROM ventas_dia")
+    con.execute("DELETE FROM ventas_producto")
+    con.execute("""
+        INSERT INTO ventas_dia (dia, pedidos, unidades, ingresos)
+        SELECT substr(p.created_at, 1, 10), COUNT(*), SUM(COALESCE(u.unidades, 0)), SUM(p.total)
+        FROM pedidos p LEFT JOIN (SELECT pedido_id, SUM(cantidad) AS unidades FROM items GROUP BY pedido_id) u
+             ON u.pedido_id = p.id
+        WHERE p.estado = 'confirmado'
+        GROUP BY substr(p.created_at, 1, 10)
+    """)
+    con.execute("""
+        INSERT INTO ventas_producto (producto_id, pedidos, unidades, ingresos)
+        SELECT i.producto_id, COUNT(DISTINCT i.pedido_id), SUM(i.cantidad), SUM(i.cantidad * i.precio_unit)
+        FROM items i JOIN pedidos p ON p.id = i.pedido_id
+        WHERE p.estado = 'confirmado'
+        GROUP BY i.producto_id
+    """)
+    n = con.execute("SELECT COUNT(*) FROM ventas_dia").fetchone()[0]
+    if n:
+        log.info("[ventas] resúmenes reconstruidos (%s días)", n)
+
+def por_dia(con, desde=None, hasta=None):
+    """Filas de ventas_dia con dia en [desde, hasta] (YYYY-MM-DD, ambos opcionales)."""
+    where, params = [], []
+    if desde:
+        where.append("dia >= ?")
+        params.append(desde)
+    if hasta:
+        where.append("dia <= ?")
+        params.append(hasta)
+    sql = "SELECT dia, pedidos, unidades, ROUND(ingresos, 2) AS ingresos FROM ventas_dia"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return [dict(r) for r in con.execute(sql + " ORDER BY dia", params)]
+
+def por_producto(con, orden="unidades", limit=100):
+    """Productos más vendidos por unidades o ingresos."""
+    columna = "ingresos" if orden == "ingresos" else "unidades"
+    return [dict(r) for r in con.execute(
+        f"SELECT producto_id, pedidos, unidades, ROUND(ingresos, 2) AS ingresos FROM ventas_producto "
+        f"ORDER BY {columna} DESC, producto_id LIMIT ?", (limit,))]
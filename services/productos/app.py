@@ -1,20 +1,35 @@
-import os, sqlite3, logging
+import os, sys, json, logging, datetime
 from functools import wraps
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from dotenv import load_dotenv
 
 load_dotenv()
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.metrics import instrument_app
+from common.formato import negociar_formato, medio_respuesta
+from common.tracing import trace_app
+from common.db import Database, add_column_if_missing
+from common.etag import etag, etag_lote, huella, coincide
+from common.importacion import FilaInvalida, formato_de, leer_filas, importar
+
 # Defaults simples
 TOKEN   = os.getenv("SERVICE_TOKEN", "penguin-secret")
 PORT    = int(os.getenv("PORT", "5001"))
 DB_PATH = os.getenv("DB_PATH", "productos.db")
+PAGE_SIZE     = int(os.getenv("PAGE_SIZE", "100"))     # página por defecto de GET /productos
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
 
 app = Flask(__name__)
-app.config["JSON_SORT_KEYS"] = False
+negociar_formato(app)
+
+db = Database(DB_PATH)
+db.init_app(app)
+instrument_app(app, "productos")
+trace_app(app, "productos")
 
 # Logging simple a consola
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(trace_id)s] %(message)s")
 log = logging.getLogger(__name__)
 
 def require_token(fn):
@@ -27,9 +42,7 @@ def require_token(fn):
     return wrapper
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db.connection()
 
 @app.get("/health")
 def health():
@@ -45,8 +58,25 @@ def init_db():
                 precio REAL NOT NULL
             )
         """)
+        # Versión por fila para ETag (DBs viejas no la tienen)
+        add_column_if_missing(con, "productos", "version", "INTEGER NOT NULL DEFAULT 1")
+        # Filtros de listado: prefijo de nombre (LIKE usa este índice por ser NOCASE) y rango de precio
+        c.execute("CREATE INDEX IF NOT EXISTS idx_productos_nombre ON productos (nombre COLLATE NOCASE)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_productos_precio ON productos (precio)")
+        # Feed de cambios: cada alta/edición/baja suma una versión (lo consultan las cachés de pedidos)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS cambios (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                producto_id INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
         con.commit()
 
+def registrar_cambio(c, pid):
+    c.execute("INSERT INTO cambios (producto_id, created_at) VALUES (?,?)",
+              (pid, datetime.datetime.utcnow().isoformat()))
+
 @app.post("/productos")
 @require_token
 def crear_producto():
@@ -58,27 +88,177 @@ def crear_producto():
     with get_db() as con:
         c = con.cursor()
         c.execute("INSERT INTO productos (nombre, precio) VALUES (?,?)", (nombre, float(precio)))
-        con.commit()
         pid = c.lastrowid
+        registrar_cambio(c, pid)
+        con.commit()
     return {"id": pid, "nombre": nombre, "precio": float(precio)}, 201
 
+@app.post("/productos/importar")
+@require_token
+def importar_productos():
+    """
+    Alta/edición masiva en streaming: NDJSON (una fila por línea) o CSV con encabezado.
+    Columnas: nombre, precio y opcionalmente id (si existe se actualiza).
+    """
+    formato = formato_de(request)
+    if formato not in ("ndjson", "csv"):
+        return {"error": "formato debe ser ndjson o csv"}, 400
+    return importar(db, leer_filas(request.stream, formato), _producto_importado, _escribir_productos)
+
+def _producto_importado(fila):
+    nombre = (fila.get("nombre") or "").strip()
+    precio = fila.get("precio")
+    if not nombre or precio is None or precio == "":
+        raise FilaInvalida("Faltan campos")
+    pid = fila.get("id")
+    pid = int(pid) if pid not in (None, "") else None
+    if pid is not None and pid <= 0:
+        raise FilaInvalida("id inválido")
+    return pid, nombre, float(precio)
+
+def _escribir_productos(c, filas):
+    """Upsert por id; cada fila tocada entra al feed de cambios (cachés de pedidos y ETag del listado)."""
+    previo = c.execute("SELECT COALESCE(MAX(id), 0) FROM productos").fetchone()[0]
+    c.executemany("INSERT INTO productos (id, nombre, precio) VALUES (?,?,?) "
+                  "ON CONFLICT(id) DO UPDATE SET nombre=excluded.nombre, precio=excluded.precio, "
+                  "version = version + 1", filas)
+    ahora = datetime.datetime.utcnow().isoformat()
+    # Altas: ids nuevos quedan por encima del máximo previo (AUTOINCREMENT no reutiliza)
+    c.execute("INSERT INTO cambios (producto_id, created_at) SELECT id, ? FROM productos WHERE id > ?",
+              (ahora, previo))
+    c.executemany("INSERT INTO cambios (producto_id, created_at) VALUES (?,?)",
+                  [(pid, ahora) for pid, _, _ in filas if pid is not None and pid <= previo])
+
 @app.get("/productos")
 @require_token
 def listar_productos():
+    # ?ids=1,2,3 resuelve varios productos en una sola consulta (lo usa pedidos)
+    ids_param = request.args.get("ids")
+    if ids_param is not None:
+        try:
+            ids = {int(x) for x in ids_param.split(",") if x.strip()}
+        except ValueError:
+            return {"error": "ids inválidos"}, 400
+        return productos_por_ids(ids, request.headers.get("If-None-Match"), medio_respuesta())
+
+    try:
+        where, params = filtros_listado(request.args)
+        after_id = int(request.args.get("after_id", 0))
+        limit = request.args.get("limit")
+        limit = min(int(limit), PAGE_SIZE_MAX) if limit is not None else None
+    except ValueError:
+        return {"error": "Parámetros inválidos"}, 400
+    if limit is not None and limit <= 0:
+        return {"error": "limit debe ser positivo"}, 400
+
+    ndjson = request.args.get("formato") == "ndjson" or "application/x-ndjson" in request.headers.get("Accept", "")
+    medio = "application/x-ndjson" if ndjson else medio_respuesta()
+    # El listado cambia sólo si cambia el catálogo: versión del feed + query + formato identifican la respuesta
+    tag = etag("c", version_catalogo(), huella(request.query_string), medio=medio)
+    if coincide(request.headers.get("If-None-Match"), tag):
+        return "", 304, {"ETag": tag, "Vary": "Accept"}
+    where.append("id > ?")
+    params.append(after_id)
+    sql = f"SELECT id, nombre, precio FROM productos WHERE {' AND '.join(where)} ORDER BY id"
+
+    # NDJSON: las filas salen a medida que las produce el cursor (sin límite salvo ?limit=)
+    if ndjson:
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return Response(stream_with_context(filas_ndjson(sql, params)), mimetype=medio,
+                        headers={"ETag": tag, "Vary": "Accept"})
+
+    # Paginación por keyset: ?after_id=<último id recibido>&limit=
+    limit = limit or PAGE_SIZE
     with get_db() as con:
         c = con.cursor()
-        rows = c.execute("SELECT id, nombre, precio FROM productos").fetchall()
-    return {"items": [dict(r) for r in rows]}
+        rows = c.execute(sql + " LIMIT ?", params + [limit]).fetchall()
+    next_after_id = rows[-1]["id"] if len(rows) == limit else None
+    return {"items": [dict(r) for r in rows], "next_after_id": next_after_id}, 200, {"ETag": tag}
+
+def productos_por_ids(ids, if_none_match=None, medio=None):
+    """
+    Lote de productos en una consulta -> (body, status, headers); 304 si el ETag del lote coincide.
+    medio: media type de la respuesta, parte del ETag (pedidos lo arma igual para revalidar).
+    """
+    ids = sorted(ids)
+    if not ids:
+        return {"items": [], "faltantes": []}, 200, {}
+    marks = ",".join("?" * len(ids))
+    with get_db() as con:
+        c = con.cursor()
+        rows = c.execute(f"SELECT id, nombre, precio, version FROM productos WHERE id IN ({marks})", ids).fetchall()
+    encontrados = {r["id"] for r in rows}
+    faltantes = [i for i in ids if i not in encontrados]
+    # ETag del lote: pedidos revalida sus entradas vencidas sin volver a bajarlas
+    tag = etag_lote([(r["id"], r["version"]) for r in rows] + [(i, 0) for i in faltantes], medio)
+    if coincide(if_none_match, tag):
+        return "", 304, {"ETag": tag, "Vary": "Accept"}
+    return {"items": [dict(r) for r in rows], "faltantes": faltantes}, 200, {"ETag": tag}
+
+def version_catalogo():
+    with get_db() as con:
+        return con.execute("SELECT COALESCE(MAX(version), 0) FROM cambios").fetchone()[0]
+
+def filtros_listado(args):
+    """?nombre=<prefijo>&precio_min=&precio_max= -> (condiciones, parámetros)."""
+    where, params = [], []
+    prefijo = args.get("nombre")
+    if prefijo:
+        escapado = prefijo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        where.append("nombre LIKE ? ESCAPE '\\'")
+        params.append(escapado + "%")
+    if args.get("precio_min") is not None:
+        where.append("precio >= ?")
+        params.append(float(args["precio_min"]))
+    if args.get("precio_max") is not None:
+        where.append("precio <= ?")
+        params.append(float(args["precio_max"]))
+    return where, params
+
+def filas_ndjson(sql, params, chunk=500):
+    con = get_db()
+    cur = con.execute(sql, params)
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            break
+        yield "".join(json.dumps(dict(r), ensure_ascii=False) + "\n" for r in rows)
+
+@app.get("/productos/cambios")
+@require_token
+def cambios_productos():
+    """Ids modificados desde la versión ?desde=N. Si hay más de ?limit=, completo=false (invalidar todo)."""
+    try:
+        desde = int(request.args.get("desde", 0))
+        limit = min(int(request.args.get("limit", 1000)), 10000)
+    except ValueError:
+        return {"error": "Parámetros inválidos"}, 400
+    return cambios_desde(desde, limit)
+
+def cambios_desde(desde, limit=1000):
+    version = version_catalogo()
+    with get_db() as con:
+        c = con.cursor()
+        rows = c.execute("SELECT version, producto_id FROM cambios WHERE version > ? ORDER BY version LIMIT ?",
+                         (desde, limit + 1)).fetchall()
+    completo = len(rows) <= limit and desde <= version
+    return {"version": version, "completo": completo,
+            "ids": sorted({r["producto_id"] for r in rows[:limit]})}
 
 @app.get("/productos/<int:pid>")
 @require_token
 def detalle_producto(pid):
     with get_db() as con:
         c = con.cursor()
-        row = c.execute("SELECT id, nombre, precio FROM productos WHERE id=?", (pid,)).fetchone()
+        row = c.execute("SELECT id, nombre, precio, version FROM productos WHERE id=?", (pid,)).fetchone()
     if not row:
         return {"error": "No encontrado"}, 404
-    return dict(row)
+    tag = etag("p", row["id"], row["version"], medio=medio_respuesta())
+    if coincide(request.headers.get("If-None-Match"), tag):
+        return "", 304, {"ETag": tag, "Vary": "Accept"}
+    return dict(row), 200, {"ETag": tag}
 
 @app.put("/productos/<int:pid>")
 @require_token
@@ -97,6 +277,8 @@ def editar_producto(pid):
             c.execute("UPDATE productos SET nombre=? WHERE id=?", (nombre, pid))
         if precio is not None:
             c.execute("UPDATE productos SET precio=? WHERE id=?", (float(precio), pid))
+        c.execute("UPDATE productos SET version = version + 1 WHERE id=?", (pid,))
+        registrar_cambio(c, pid)
         con.commit()
     return {"ok": True}
 
@@ -106,9 +288,15 @@ def borrar_producto(pid):
     with get_db() as con:
         c = con.cursor()
         c.execute("DELETE FROM productos WHERE id=?", (pid,))
+        if c.rowcount:
+            registrar_cambio(c, pid)
         con.commit()
     return {"ok": True}
 
-if __name__ == "__main__":
+def create_app():
+    """Fábrica para servidores WSGI (serve.py): prepara el esquema una vez por proceso."""
     init_db()
-    app.run(host="0.0.0.0", port=PORT, debug=True)
+    return app
+
+if __name__ == "__main__":
+    create_app().run(host="0.0.0.0", port=PORT, debug=True)
@@ -0,0 +1,48 @@
+#!/usr/bin/env bash
+# Equivalente Linux/Mac de run_all.bat: levanta los cuatro servicios con serve.py (gunicorn).
+# Cada servicio usa su venv (se crea si falta) y escribe a <servicio>/logs.log.
+# Ctrl+C (o SIGTERM) baja los cuatro.
+#
+#   ./run_all.sh                       # WEB_WORKERS / WEB_THREADS / WEB_SERVER se pasan tal cual
+#   WEB_WORKERS=4 ./run_all.sh
+set -euo pipefail
+cd "$(dirname "$0")"
+
+PY="${PYTHON:-python3}"
+export SERVICE_TOKEN="${SERVICE_TOKEN:-penguin-secret}"
+export PRODUCTS_URL="${PRODUCTS_URL:-http://127.0.0.1:5001}"
+export INVENTORY_URL="${INVENTORY_URL:-http://127.0.0.1:5002}"
+export PAYMENTS_URL="${PAYMENTS_URL:-http://127.0.0.1:5003}"
+
+pids=()
+
+arrancar() {
+  local svc="$1" port="$2"
+  (
+    cd "$svc"
+    if [ ! -x venv/bin/python ]; then
+      echo "[$svc] creando venv..."
+      "$PY" -m venv venv
+    fi
+    echo "[$svc] instalando deps..."
+    venv/bin/python -m pip install -q -r requirements.txt
+    echo "[$svc] arrancando en $port..."
+    PORT="$port" exec venv/bin/python ../serve.py "$svc"
+  ) >> "$svc/logs.log" 2>&1 &
+  pids+=($!)
+}
+
+bajar() {
+  echo "bajando servicios..."
+  kill "${pids[@]}" 2>/dev/null || true
+  wait
+}
+trap bajar INT TERM
+
+arrancar productos 5001
+arrancar inventario 5002
+arrancar pagos 5003
+arrancar pedidos 5004
+
+echo "productos :5001  inventario :5002  pagos :5003  pedidos :5004  (logs en <servicio>/logs.log)"
+wait
@@ -0,0 +1,95 @@
+"""
+Entrada de producción de cada servicio (en vez de app.run con el servidor de desarrollo).
+
+    python serve.py pedidos                      # gunicorn en Linux/Mac, waitress en Windows
+    python serve.py productos --servidor waitress
+    python serve.py pedidos --servidor uvicorn   # pedidos en modo async (asgi.py)
+    python serve.py monolito                     # los cuatro en un proceso (monolito.py)
+
+- gunicorn: WEB_WORKERS procesos x WEB_THREADS hilos (worker gthread). El esquema se crea
+  una vez en el master antes de forkear; cada worker llama a create_app() al arrancar.
+- waitress: un proceso con WEB_THREADS hilos (sin fork, sirve en Windows).
+- uvicorn: WEB_WORKERS procesos sobre asgi.application (sólo pedidos); el esquema también
+  se crea una vez antes de arrancar los workers.
+Puerto y demás configuración salen del .env / entorno del servicio, como con app.py.
+"""
+import os
+import sys
+import argparse
+import importlib
+
+SERVICES = os.path.dirname(os.path.abspath(__file__))
+SERVICIOS = ("productos", "inventario", "pagos", "pedidos")
+
+HOST         = os.getenv("HOST", "0.0.0.0")
+WEB_WORKERS  = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 2)))
+WEB_THREADS  = int(os.getenv("WEB_THREADS", "8"))
+WEB_TIMEOUT  = int(os.getenv("WEB_TIMEOUT", "30"))           # s sin respuesta antes de reciclar un worker
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "5"))         # s de keep-alive con el cliente
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "0"))  # reciclar workers cada N requests (0 = nunca)
+WEB_BACKLOG  = int(os.getenv("WEB_BACKLOG", "2048"))
+
+def cargar_servicio(svc: str):
+    """Importa <svc>/app.py como lo haría `python app.py` (cwd y .env del servicio)."""
+    if svc == "monolito":
+        os.chdir(SERVICES)
+        sys.path.insert(0, SERVICES)
+        return importlib.import_module("monolito")
+    carpeta = os.path.join(SERVICES, svc)
+    os.chdir(carpeta)
+    sys.path.insert(0, carpeta)
+    return importlib.import_module("app")
+
+def servir_gunicorn(mod):
+    from gunicorn.app.base import BaseApplication
+
+    class Gunicorn(BaseApplication):
+        def load_config(self):
+            opciones = {
+                "bind": f"{HOST}:{mod.PORT}",
+                "workers": WEB_WORKERS,
+                "threads": WEB_THREADS,
+                "worker_class": "gthread",
+                "timeout": WEB_TIMEOUT,
+                "keepalive": WEB_KEEPALIVE,
+                "max_requests": WEB_MAX_REQUESTS,
+                "max_requests_jitter": WEB_MAX_REQUESTS // 10,
+                "backlog": WEB_BACKLOG,
+            }
+            for k, v in opciones.items():
+                self.cfg.set(k, v)
+
+        def load(self):
+            return mod.create_app()
+
+    mod.init_db()    # en el master: los workers encuentran el esquema hecho y no compiten por migrarlo
+    Gunicorn().run()
+
+def servir_waitress(mod):
+    from waitress import serve
+    serve(mod.create_app(), host=HOST, port=mod.PORT, threads=WEB_THREADS,
+          backlog=WEB_BACKLOG, channel_timeout=WEB_TIMEOUT)
+
+def servir_uvicorn(mod):
+    import uvicorn
+    # Como con gunicorn: el esquema se crea acá una vez y los workers (que heredan el entorno)
+    # no corren init_db() en su lifespan a la vez
+    mod.init_db()
+    os.environ["ESQUEMA_LISTO"] = "1"
+    uvicorn.run("asgi:application", host=HOST, port=mod.PORT, workers=WEB_WORKERS,
+                timeout_keep_alive=WEB_KEEPALIVE, backlog=WEB_BACKLOG, log_level="warning")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Sirve un servicio con un servidor de producción")
+    ap.add_argument("servicio", choices=SERVICIOS + ("monolito",))
+    ap.add_argument("--servidor", choices=("gunicorn", "waitress", "uvicorn"),
+                    default=os.getenv("WEB_SERVER") or ("waitress" if os.name == "nt" else "gunicorn"))
+    args = ap.parse_args(argv)
+    if args.servidor == "uvicorn" and args.servicio != "pedidos":
+        ap.error("uvicorn sólo aplica a pedidos (asgi.py)")
+
+    mod = cargar_servicio(args.servicio)
+    {"gunicorn": servir_gunicorn, "waitress": servir_waitress, "uvicorn": servir_uvicorn}[args.servidor](mod)
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,7 @@ python -m pip install -r requirements.txt
 set SERVICE_TOKEN=penguin-secret
 set PORT=5002
 echo [inventario] arrancando en %PORT%...
-python app.py
+python ..\serve.py inventario
 echo.
 echo [inventario] terminado. Exit code %ERRORLEVEL%
 pause
@@ -11,7 +11,7 @@ python -m pip install -r requirements.txt
 set SERVICE_TOKEN=penguin-secret
 set PORT=5003
 echo [pagos] arrancando en %PORT%...
-python app.py
+python ..\serve.py pagos
 echo.
 echo [pagos] terminado. Exit code %ERRORLEVEL%
 pause
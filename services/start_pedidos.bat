@@ -43,8 +43,8 @@ echo [pedidos] INVENTORY_URL=%INVENTORY_URL%
 echo [pedidos] PAYMENTS_URL=%PAYMENTS_URL%
 
 REM === 5) Lanzar el servicio ===
-echo [pedidos] arrancando Flask...
-python app.py
+echo [pedidos] arrancando (waitress)...
+python ..\serve.py pedidos
 
 echo.
 echo [pedidos] terminado. Exit code %ERRORLEVEL%
@@ -11,7 +11,7 @@ python -m pip install -r requirements.txt
 set SERVICE_TOKEN=penguin-secret
 set PORT=5001
 echo [productos] arrancando en %PORT%...
-python app.py
+python ..\serve.py productos
 echo.
 echo [productos] terminado. Exit code %ERRORLEVEL%
 pause